@@ -17,6 +17,9 @@ extras_require = {
             'pytest>=3.0.0',
             'responses',
             'pytest-cov',
+        ],
+        'checkpoint': [
+            'cryptography',
         ]
 }
 
@@ -43,7 +46,8 @@ setup(
     dependency_links=dependency_links,
     entry_points={
         'console_scripts': [
-            'vaultkeeper = vaultkeeper.vaultkeeper:main'
+            'vaultkeeper = vaultkeeper.vaultkeeper:main',
+            'vaultkeeper-cache = vaultkeeper.cache:main'
         ]
     },
 )
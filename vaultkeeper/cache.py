@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import SocketServer
+
+import hvac
+import requests
+
+from configparser import ConfigParser
+from session import build_session, request_timeout
+
+
+class SecretCache(object):
+    def __init__(self, vault_addr, ttl, session=None, timeout=30):
+        """
+        Cache reads of static secrets on behalf of local Vaultkeeper
+        agents.
+
+        Every read is made with the requesting agent's own token. A
+        cached secret is only served to a token that Vault has confirmed
+        may read its path, and both secrets and confirmations expire
+        after ttl seconds.
+
+        :param vault_addr: The address for the Vault server.
+        :param ttl: Time (in seconds) for which to cache reads.
+        :param session: The requests session used to talk to Vault.
+        :param timeout: The timeout for Vault requests.
+        """
+        self.vault_addr = vault_addr
+        self.ttl = ttl
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.entries = {}
+        self.grants = {}
+        self.lock = threading.Lock()
+        # One lock per path, held while the path is read from Vault, so
+        # that concurrent misses for a path share a single read.
+        self.reads = {}
+
+    def client(self, token):
+        return hvac.Client(url=self.vault_addr, token=token,
+                           session=self.session, timeout=self.timeout)
+
+    def grant_key(self, token, path):
+        return (hashlib.sha256(token).hexdigest(), path)
+
+    def evict_locked(self, now):
+        for cache in (self.entries, self.grants):
+            for key, (expires_at, _) in cache.items():
+                if expires_at <= now:
+                    del cache[key]
+
+    def lookup(self, cache, key, now):
+        with self.lock:
+            entry = cache.get(key)
+            if entry is None or entry[0] <= now:
+                return None
+            return entry[1]
+
+    def store(self, cache, key, value, ttl, now):
+        with self.lock:
+            self.evict_locked(now)
+            cache[key] = (now + ttl, value)
+
+    def allowed(self, token, path, now):
+        key = self.grant_key(token, path)
+        if self.lookup(self.grants, key, now):
+            return True
+        r = self.session.post(self.vault_addr + '/v1/sys/capabilities-self',
+                              headers={'X-Vault-Token': token},
+                              json={'path': path}, timeout=self.timeout)
+        r.raise_for_status()
+        response = r.json()
+        capabilities = (response.get('capabilities')
+                        or response.get(path) or [])
+        allowed = 'read' in capabilities or 'root' in capabilities
+        if allowed:
+            self.store(self.grants, key, True, self.ttl, now)
+        return allowed
+
+    def read_lock(self, path):
+        with self.lock:
+            return self.reads.setdefault(path, threading.Lock())
+
+    def read(self, token, path):
+        now = time.time()
+        cached = self.lookup(self.entries, path, now)
+        if cached is None:
+            with self.read_lock(path):
+                # Another request may have read the path in the meantime.
+                now = time.time()
+                cached = self.lookup(self.entries, path, now)
+                if cached is None:
+                    return self.fetch(token, path, now)
+        if not self.allowed(token, path, now):
+            raise RuntimeError('Permission denied reading ' + path)
+        return cached
+
+    def fetch(self, token, path, now):
+        response = self.client(token).read(path)
+        if response is None:
+            raise RuntimeError('No secret found at ' + path)
+        ttl = self.ttl
+        if response.get('lease_duration'):
+            ttl = min(ttl, response['lease_duration'])
+        self.store(self.entries, path, response, ttl, now)
+        self.store(self.grants, self.grant_key(token, path), True, ttl, now)
+        return response
+
+
+class CacheRequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            try:
+                request = json.loads(line)
+                data = self.server.cache.read(
+                    str(request['token']), request['path'])
+                reply = {'ok': True, 'data': data}
+            except Exception as e:
+                reply = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(reply) + '\n')
+            self.wfile.flush()
+
+
+class SecretCacheServer(SocketServer.ThreadingMixIn,
+                        SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, cache, mode=0o660):
+        """
+        Serve a SecretCache over a unix socket, one JSON request per line.
+
+        :param socket_path: The path of the unix socket.
+        :param cache: A SecretCache object.
+        :param mode: The permission bits for the socket.
+        """
+        self.cache = cache
+        self.mode = mode
+        SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                               CacheRequestHandler)
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        SocketServer.UnixStreamServer.server_bind(self)
+        os.chmod(self.server_address, self.mode)
+
+
+def read_cached(socket_path, token, path, timeout):
+    """
+    Read a secret through a local SecretCacheServer.
+
+    Raises socket.error if the cache cannot be reached, so that callers
+    can fall back to reading from Vault directly.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps({'token': token, 'path': path}) + '\n')
+        reply = client.makefile('rb').readline()
+    finally:
+        client.close()
+    if not reply:
+        raise socket.error('The secret cache closed the connection.')
+    reply = json.loads(reply)
+    if not reply['ok']:
+        raise RuntimeError('The secret cache could not read ' + path
+                           + ': ' + reply['error'])
+    return reply['data']
+
+
+def get_cache_cfg(env=os.environ):
+    config = env['VAULTKEEPER_CACHE_CONFIG']
+    if config is None:
+        raise KeyError('Could not retrieve the secret cache '
+                       + 'configuration from the environment.')
+    return config
+
+
+def main():
+    from vaultkeeper import get_vault_addr
+
+    data = json.loads(get_cache_cfg())
+    configs = ConfigParser()
+    cache = SecretCache(get_vault_addr(), data['ttl'],
+                        session=build_session(configs),
+                        timeout=request_timeout(configs))
+    server = SecretCacheServer(data['socket_path'], cache,
+                               int(data.get('socket_mode', '0660'), 8))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import json
+import os
+import time
+
+from writer import atomic_write
+
+
+def fernet(key):
+    """
+    A Fernet cipher for the given key. The cryptography package is only
+    needed, and only imported, when checkpointing is configured.
+    """
+    try:
+        from cryptography.fernet import Fernet
+    except ImportError:
+        raise RuntimeError('Checkpointing requires the cryptography '
+                           'package, which is installed with '
+                           'vaultkeeper[checkpoint].')
+    return Fernet(key)
+
+
+class Checkpoint(object):
+    def __init__(self, path, key):
+        """
+        Keep the agent's Vault token and leases in an encrypted file, so
+        that an agent that is restarted can resume them rather than be
+        issued new ones.
+
+        :param path: The checkpoint file. It should be on a tmpfs, so
+            that it never outlives the node, and is only ever written with
+            mode 0600.
+        :param key: A Fernet key, as made by Fernet.generate_key().
+        """
+        self.path = path
+        self.cipher = fernet(key)
+
+    def save(self, token, secrets, retiring=()):
+        """
+        :param token: The agent's Vault token.
+        :param secrets: A dictionary of Secret objects, of which those
+            with renewable leases are saved.
+        :param retiring: Rotated leases that are yet to be revoked.
+        """
+        state = {
+            'saved_at': time.time(),
+            'token': token.checkpoint(),
+            'secrets': dict((name, s.checkpoint())
+                            for name, s in secrets.iteritems()
+                            if s.fetched and s.renewable and s.lease_id),
+            'retiring': [lease.checkpoint() for lease in retiring],
+        }
+        atomic_write(self.path, self.cipher.encrypt(json.dumps(state)),
+                     0o600)
+
+    def load(self):
+        """
+        The saved state, or None if there is none that this key can read.
+        """
+        from cryptography.fernet import InvalidToken
+
+        try:
+            with open(self.path, 'rb') as f:
+                return json.loads(self.cipher.decrypt(f.read()))
+        except (IOError, ValueError, InvalidToken):
+            return None
+
+    def clear(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,285 @@
+import json
+import os
+import shlex
+import signal
+import socket
+import threading
+import time
+import subprocess32 as subprocess
+from subprocess32 import TimeoutExpired
+
+from handoff import handoff_fd
+
+
+def stop_processes(processes, timeout):
+    """
+    Terminate processes together, killing those that have not exited
+    within timeout seconds, so that stopping several takes no longer than
+    stopping one.
+    """
+    running = [process for process in processes
+               if process is not None and process.poll() is None]
+    for process in running:
+        process.terminate()
+    deadline = time.time() + timeout
+    for process in running:
+        try:
+            process.wait(timeout=max(deadline - time.time(), 0))
+        except TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+class RestartPolicy(object):
+    def __init__(self, max_restarts, backoff=1, max_backoff=60,
+                 exit_codes=None):
+        """
+        When to restart a process that exited, rather than shut down.
+
+        :param max_restarts: The number of times the process may be
+            restarted.
+        :param backoff: Time (in seconds) to wait before the first restart,
+            which doubles with every restart after it.
+        :param max_backoff: The longest time (in seconds) to wait before a
+            restart.
+        :param exit_codes: The exit codes after which to restart the
+            process, or None for any but 0.
+        """
+        self.max_restarts = max_restarts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.exit_codes = exit_codes
+
+    def allows(self, returncode, restarts):
+        if restarts >= self.max_restarts:
+            return False
+        if self.exit_codes is None:
+            return returncode != 0
+        return returncode in self.exit_codes
+
+    def delay(self, restarts):
+        return min(self.backoff * 2 ** restarts, self.max_backoff)
+
+
+class Handover(object):
+    def __init__(self, probe, timeout=60, interval=0.5):
+        """
+        How to tell when a process started to take over from another one
+        is ready to.
+
+        :param probe: "exec:<command>", for a command that succeeds once
+            the process is ready. "{pid}" in the command is replaced with
+            the id of the new process.
+        :param timeout: Time (in seconds) for the process to become ready,
+            after which it is stopped.
+        :param interval: Time (in seconds) between probes.
+        """
+        if probe.startswith('tcp:'):
+            # The old process still holds the port, so it would pass the
+            # probe before the new one is ready.
+            raise KeyError('TCP readiness probes cannot tell a new process '
+                           'from the one it takes over from: ' + probe)
+        if not probe.startswith('exec:'):
+            raise KeyError('Unknown readiness probe: ' + probe)
+        self.probe = probe
+        self.timeout = timeout
+        self.interval = interval
+
+    def ready(self, process):
+        command = self.probe[len('exec:'):]
+        command = command.replace('{pid}', str(process.pid))
+        try:
+            return subprocess.call(shlex.split(command),
+                                   timeout=self.timeout) == 0
+        except TimeoutExpired:
+            return False
+
+    def wait(self, process):
+        """
+        Wait for a process to pass the probe, returning whether it did
+        before it exited or ran out of time.
+        """
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            if process.poll() is not None:
+                return False
+            if self.ready(process):
+                return True
+            time.sleep(self.interval)
+        return False
+
+
+class Child(object):
+    def __init__(self, name, entry_cmd, secret_ids=None, renderers=None,
+                 notify=None, restart=None, handover=None,
+                 output_mode='file', fd_env='VAULTKEEPER_CREDENTIALS_FD',
+                 environment=None):
+        """
+        A process supervised by Vaultkeeper.
+
+        :param name: The logical name of the process.
+        :param entry_cmd: The command line that starts the process.
+        :param secret_ids: The ids of the secrets this process consumes,
+            or None for all of them.
+        :param renderers: The renderers writing this process' output.
+        :param notify: How to tell the process that a secret was rotated:
+            either a signal name such as "SIGHUP", or "unix:<path>" for a
+            control socket that is sent a JSON message. None to not notify.
+        :param restart: A RestartPolicy for the process, or None to never
+            restart it.
+        :param handover: A Handover to replace the process with a new one
+            when its secrets change, or None to notify it instead.
+        :param output_mode: "file" to write the rendered output to disk,
+            "memfd" or "pipe" to hand it to the process as inherited file
+            descriptors instead, or "none" to not render any output.
+        :param fd_env: The environment variable that tells the process
+            which file descriptors hold its output, in the memfd and pipe
+            output modes.
+        :param environment: An EnvironmentMapping from the secrets to
+            environment variables for the process, or None.
+        """
+        self.name = name
+        self.entry_cmd = entry_cmd
+        self.secret_ids = secret_ids
+        self.renderers = renderers or []
+        self.notify = notify
+        self.restart = restart
+        self.restarts = 0
+        self.handover = handover
+        # Whether the process is waiting to be handed over from.
+        self.handover_due = False
+        self.output_mode = output_mode
+        self.fd_env = fd_env
+        # The rendered output to hand over when the process is started,
+        # in the memfd and pipe output modes.
+        self.outputs = []
+        self.environment = environment
+        # The environment variables rendered for the process.
+        self.env = {}
+        self.process = None
+        # Guards replacing the process against noticing that it exited.
+        self.lock = threading.Lock()
+
+    def secrets(self, secrets):
+        """
+        The fetched secrets that this process consumes.
+        """
+        return dict((name, cred) for name, cred in secrets.iteritems()
+                    if cred.fetched and self.uses(name))
+
+    def render(self, secrets):
+        output = []
+        consumed = self.secrets(secrets)
+        for renderer in self.renderers:
+            output.extend(renderer.render(consumed))
+        return output
+
+    def render_environment(self, secrets):
+        if self.environment is None:
+            return {}
+        return self.environment.variables(self.secrets(secrets))
+
+    def start(self):
+        args = shlex.split(self.entry_cmd.encode('utf-8', errors='ignore'))
+        env = None
+        if self.env:
+            env = dict(os.environ)
+            env.update(self.env)
+        if self.output_mode not in ('memfd', 'pipe'):
+            return subprocess.Popen(args,
+                                    shell=False,
+                                    env=env
+                                    )
+        fds = []
+        try:
+            for _, content in self.outputs:
+                fds.append(handoff_fd(self.output_mode, content))
+            env = dict(env or os.environ)
+            env[self.fd_env] = ','.join(str(fd) for fd in fds)
+            return subprocess.Popen(args,
+                                    shell=False,
+                                    pass_fds=fds,
+                                    env=env
+                                    )
+        finally:
+            # The process holds its own copies.
+            for fd in fds:
+                os.close(fd)
+
+    def spawn(self):
+        process = self.start()
+        with self.lock:
+            self.process = process
+        return process
+
+    def hand_over(self, stop_timeout):
+        """
+        Start a new process, and stop the old one once the new one is
+        ready to take over.
+
+        :returns: Whether the new process took over. It does not if it
+            failed its readiness probe, or if the old process exited in
+            the meantime, and is stopped instead.
+        """
+        new = self.start()
+        ready = self.handover.wait(new)
+        with self.lock:
+            old = self.process
+            took_over = ready and old.poll() is None
+            if took_over:
+                self.process = new
+        if not took_over:
+            stop_processes([new], stop_timeout)
+            return False
+        stop_processes([old], stop_timeout)
+        return True
+
+    def replaced(self, process):
+        """
+        Whether the process has been handed over from, so that its exit
+        is expected.
+        """
+        with self.lock:
+            return process is not self.process
+
+    def restart_delay(self):
+        """
+        Time (in seconds) to wait before restarting the process after it
+        exited, or None if it should not be restarted.
+        """
+        if self.restart is None or not self.restart.allows(
+                self.process.returncode, self.restarts):
+            return None
+        return self.restart.delay(self.restarts)
+
+    def respawn(self):
+        self.restarts += 1
+        return self.spawn()
+
+    def uses(self, secret_id):
+        return self.secret_ids is None or secret_id in self.secret_ids
+
+    def rotated(self, secret_id, timeout=5):
+        """
+        Tell the process that the credentials of a secret it consumes have
+        been replaced.
+        """
+        if self.notify is None or not self.uses(secret_id):
+            return
+        if self.notify.startswith('unix:'):
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.settimeout(timeout)
+            try:
+                client.connect(self.notify[len('unix:'):])
+                client.sendall(json.dumps({'event': 'rotated',
+                                           'secret': secret_id}) + '\n')
+            finally:
+                client.close()
+        elif self.process is not None and self.process.poll() is None:
+            self.process.send_signal(getattr(signal, self.notify))
+
+    def stop(self, timeout):
+        """
+        Stop the process, if it has been started.
+        """
+        stop_processes([self.process], timeout)
@@ -0,0 +1,71 @@
+import threading
+import time
+from Queue import Queue, Empty
+
+
+class BudgetExceeded(RuntimeError):
+    pass
+
+
+def map_concurrently(fn, items, workers, timeout=None, wait=False):
+    """
+    Call fn on every item using at most `workers` threads.
+
+    Results are returned in the order of `items`. The first exception
+    raised by fn is re-raised as soon as it is seen, and items which have
+    not been started yet are abandoned. If wait is true, the items which
+    had been started are finished before the exception is raised, so that
+    the caller can undo all of them. If timeout is given and not every
+    item has been handled within that many seconds, BudgetExceeded is
+    raised and the remaining items are abandoned.
+    """
+    items = list(items)
+    workers = min(workers, len(items))
+    if workers < 1 or (workers == 1 and timeout is None):
+        return [fn(item) for item in items]
+
+    pending = Queue()
+    for entry in enumerate(items):
+        pending.put(entry)
+    done = Queue()
+    stop = threading.Event()
+
+    def worker():
+        while not stop.is_set():
+            try:
+                index, item = pending.get_nowait()
+            except Empty:
+                return
+            try:
+                done.put((index, None, fn(item)))
+            except Exception as e:
+                done.put((index, e, None))
+
+    threads = []
+    for _ in range(workers):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    deadline = None if timeout is None else time.time() + timeout
+    results = [None] * len(items)
+    for _ in items:
+        try:
+            if deadline is None:
+                index, error, result = done.get()
+            else:
+                index, error, result = done.get(
+                    timeout=max(deadline - time.time(), 0))
+        except Empty:
+            stop.set()
+            raise BudgetExceeded('Ran out of time after %s seconds.'
+                                 % timeout)
+        if error is not None:
+            stop.set()
+            if wait:
+                for thread in threads:
+                    thread.join()
+            raise error
+        results[index] = result
+    return results
@@ -8,12 +8,97 @@ class ConfigParser(object):
         self.output_path = None
         self.refresh_interval = None
         self.renewal_grace = None
+        self.lease_increment = None
+        self.output_permissions = 0o600
+        self.renderers = None
+        self.fetch_workers = 1
+        self.pipelined_startup = False
+        self.metrics_address = None
+        self.processes = None
+        self.stop_timeout = 10
+        self.cache_socket = None
+        self.renewal_workers = 1
+        self.renewal_jitter = 0
+        self.renewal_splay = 0
+        self.shutdown_budget = None
+        self.secrets_path = None
+        self.secrets_poll_interval = 5
+        self.rotation_window = None
+        self.rotation_overlap = 60
+        self.rotation_notify = None
+        self.kv_cache_path = None
+        self.startup_deadline = None
+        self.startup_phase_budgets = None
+        self.read_retries = 0
+        self.read_retry_backoff = 0.1
+        self.checkpoint_path = None
+        self.checkpoint_key_env = 'VAULTKEEPER_CHECKPOINT_KEY'
+        self.restart_max = 0
+        self.restart_backoff = 1
+        self.restart_max_backoff = 60
+        self.restart_exit_codes = None
+        self.reload_mode = 'notify'
+        self.readiness_probe = None
+        self.readiness_timeout = 60
+        self.readiness_interval = 0.5
+        self.output_mode = 'file'
+        self.output_fd_env = 'VAULTKEEPER_CREDENTIALS_FD'
+        self.environment = None
+        self.http_pool_size = 10
+        self.http_connect_timeout = 5
+        self.http_read_timeout = 30
+        self.http_retries = 0
+        self.http_retry_backoff = 0.5
 
     def load_data(self, data):
         self.entry_cmd = data['entry_cmd']
         self.output_path = data['output_path']
         self.refresh_interval = data['refresh_interval']
         self.renewal_grace = data['renewal_grace']
+        self.lease_increment = data.get('lease_increment')
+        self.renderers = data.get('renderers')
+        self.output_permissions = int(
+            data.get('output_permissions', '0600'), 8)
+        self.fetch_workers = data.get('fetch_workers', 1)
+        self.pipelined_startup = data.get('pipelined_startup', False)
+        self.metrics_address = data.get('metrics_address')
+        self.processes = data.get('processes')
+        self.stop_timeout = data.get('stop_timeout', 10)
+        self.cache_socket = data.get('cache_socket')
+        self.renewal_workers = data.get('renewal_workers', 1)
+        self.renewal_jitter = data.get('renewal_jitter', 0)
+        self.renewal_splay = data.get('renewal_splay', 0)
+        self.shutdown_budget = data.get('shutdown_budget')
+        self.secrets_path = data.get('secrets_path')
+        self.secrets_poll_interval = data.get('secrets_poll_interval', 5)
+        self.rotation_window = data.get('rotation_window')
+        self.rotation_overlap = data.get('rotation_overlap', 60)
+        self.rotation_notify = data.get('rotation_notify')
+        self.kv_cache_path = data.get('kv_cache_path')
+        self.startup_deadline = data.get('startup_deadline')
+        self.startup_phase_budgets = data.get('startup_phase_budgets')
+        self.read_retries = data.get('read_retries', 0)
+        self.read_retry_backoff = data.get('read_retry_backoff', 0.1)
+        self.checkpoint_path = data.get('checkpoint_path')
+        self.checkpoint_key_env = data.get('checkpoint_key_env',
+                                           'VAULTKEEPER_CHECKPOINT_KEY')
+        self.restart_max = data.get('restart_max', 0)
+        self.restart_backoff = data.get('restart_backoff', 1)
+        self.restart_max_backoff = data.get('restart_max_backoff', 60)
+        self.restart_exit_codes = data.get('restart_exit_codes')
+        self.reload_mode = data.get('reload_mode', 'notify')
+        self.readiness_probe = data.get('readiness_probe')
+        self.readiness_timeout = data.get('readiness_timeout', 60)
+        self.readiness_interval = data.get('readiness_interval', 0.5)
+        self.output_mode = data.get('output_mode', 'file')
+        self.output_fd_env = data.get('output_fd_env',
+                                      'VAULTKEEPER_CREDENTIALS_FD')
+        self.environment = data.get('environment')
+        self.http_pool_size = data.get('http_pool_size', 10)
+        self.http_connect_timeout = data.get('http_connect_timeout', 5)
+        self.http_read_timeout = data.get('http_read_timeout', 30)
+        self.http_retries = data.get('http_retries', 0)
+        self.http_retry_backoff = data.get('http_retry_backoff', 0.5)
 
     def load_configs(self):
         data = json.loads(self.config)
@@ -0,0 +1,207 @@
+import logging
+import threading
+import time
+from Queue import Queue, Empty
+
+EXITED = 'exited'
+WAKE = 'wake'
+FAILED = 'failed'
+
+
+class EventLoop(object):
+    def __init__(self, workers=1):
+        """
+        Run blocking work on background threads and hand its outcomes to
+        a single thread as events.
+
+        Waiting on processes and talking to Vault happen off the loop's
+        thread, so neither delays noticing the other. Events are handled
+        one at a time by whoever calls next_event(), and errors raised by
+        tasks are handed over with them.
+
+        :param workers: The number of threads running submitted tasks.
+        """
+        self.events = Queue()
+        self.tasks = Queue()
+        self.running = set()
+        self.lock = threading.Lock()
+        for _ in range(max(workers, 1)):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+
+    def post(self, event, *args):
+        self.events.put((event, args))
+
+    def next_event(self, timeout):
+        """
+        Wait up to timeout seconds for an event, returning None if there
+        was none. A timeout is always used, because a blocking get would
+        keep signal handlers from running on Python 2.
+        """
+        try:
+            return self.events.get(timeout=max(timeout, 0))
+        except Empty:
+            return None
+
+    def watch(self, child):
+        """
+        Post an EXITED event once the child's current process exits.
+        """
+        process = child.process
+
+        def wait():
+            process.wait()
+            self.post(EXITED, child, process)
+
+        thread = threading.Thread(target=wait)
+        thread.daemon = True
+        thread.start()
+
+    def submit(self, name, fn, *args):
+        """
+        Run fn on a worker thread, unless a task of the same name is
+        already queued or running. A WAKE event is posted when it is done,
+        or a FAILED event if it raised.
+
+        :returns: Whether the task was queued.
+        """
+        with self.lock:
+            if name in self.running:
+                return False
+            self.running.add(name)
+        self.tasks.put((name, fn, args))
+        return True
+
+    def work(self):
+        while True:
+            name, fn, args = self.tasks.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                event = (FAILED, name, e)
+            else:
+                event = (WAKE,)
+            # Only report back once the task can be submitted again.
+            with self.lock:
+                self.running.discard(name)
+            self.post(*event)
+
+
+class AgentCore(object):
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, vaultkeeper):
+        """
+        Supervise a started Vaultkeeper's processes and keep its leases
+        alive until one of the processes exits.
+
+        Renewals, reloads, revocations of retired leases and blue/green
+        handovers run as tasks on an EventLoop, while this thread only
+        reacts to their outcome, to process exits and to renewal deadlines.
+
+        :param vaultkeeper: A Vaultkeeper whose processes are running.
+        """
+        self.vaultkeeper = vaultkeeper
+        # Besides renewals, reloads and revocations can run alongside a
+        # blue/green handover of each process.
+        self.loop = EventLoop(vaultkeeper.configs.renewal_workers + 2
+                              + len(vaultkeeper.children or []))
+        # Processes waiting to be restarted, and when to restart them.
+        self.restarts = {}
+
+    def wake(self):
+        """
+        Make the core reconsider its deadlines, for instance after a
+        reload was requested from a signal handler.
+        """
+        self.loop.post(WAKE)
+
+    def tick(self):
+        """
+        Start whatever work is due, returning the time (in seconds) until
+        more might be.
+        """
+        vaultkeeper = self.vaultkeeper
+        now = time.time()
+        for child, restart_at in self.restarts.items():
+            if restart_at > now:
+                continue
+            del self.restarts[child]
+            try:
+                vaultkeeper.restart_child(child)
+            except OSError as e:
+                self.logger.error('Could not restart process ' + child.name
+                                  + ': ' + str(e))
+                self.loop.post(EXITED, child, child.process)
+                continue
+            self.loop.watch(child)
+        if vaultkeeper.reload_due():
+            self.loop.submit('reload', vaultkeeper.reload_secrets)
+        for child in vaultkeeper.children or []:
+            if child.handover_due:
+                # A handover requested while another one is running is
+                # submitted again once that one is done.
+                self.loop.submit('handover ' + child.name,
+                                 vaultkeeper.hand_over, child)
+        due = vaultkeeper.scheduler.next_due()
+        if due is not None and due <= now:
+            self.loop.submit('renew', vaultkeeper.renew_due)
+        if vaultkeeper.retirement_due(now):
+            self.loop.submit('retire', vaultkeeper.retire_due)
+        wakeup = vaultkeeper.next_wakeup()
+        if wakeup <= 0:
+            # Anything still due is already being worked on, and its task
+            # wakes the loop when it is done.
+            wakeup = vaultkeeper.configs.refresh_interval
+        for restart_at in self.restarts.itervalues():
+            wakeup = min(wakeup, max(restart_at - now, 0))
+        return wakeup
+
+    def shutdown(self, child):
+        """
+        Stop the processes, revoke the leases and return the exit code of
+        the process that brought the agent down.
+        """
+        self.vaultkeeper.stop_children()
+        self.vaultkeeper.cleanup()
+        return child.process.returncode
+
+    def run(self):
+        """
+        Handle events until a supervised process exits without being
+        restarted, then stop the others, revoke the leases and return the
+        exit code.
+        """
+        vaultkeeper = self.vaultkeeper
+        vaultkeeper.schedule_renewals()
+        for child in vaultkeeper.children:
+            self.loop.watch(child)
+        wakeup = self.tick()
+        while True:
+            event = self.loop.next_event(wakeup)
+            if event is not None and event[0] == FAILED:
+                name, error = event[1]
+                self.logger.error('The ' + name + ' task failed.')
+                raise error
+            elif event is not None and event[0] == EXITED:
+                exited, process = event[1]
+                if exited.replaced(process):
+                    # The process was stopped after handing over to a new
+                    # one, which is watched in its place.
+                    wakeup = self.tick()
+                    continue
+                delay = vaultkeeper.restart_delay(exited)
+                if delay is None:
+                    self.logger.info('Process ' + exited.name + ' exited.')
+                    return self.shutdown(exited)
+                self.logger.warning(
+                    'Process %s exited with code %s, restarting it in %s '
+                    'seconds.' % (exited.name, exited.process.returncode,
+                                  delay))
+                self.restarts[exited] = time.time() + delay
+            if vaultkeeper.stopping and self.restarts:
+                # The agent is being stopped, so there is nothing left to
+                # restart the processes for.
+                return self.shutdown(next(iter(self.restarts)))
+            wakeup = self.tick()
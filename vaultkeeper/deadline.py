@@ -0,0 +1,122 @@
+import random
+import time
+from contextlib import contextmanager
+
+
+class StartupTimeout(RuntimeError):
+    def __init__(self, phase, budget):
+        RuntimeError.__init__(
+            self, 'Startup ran out of its %s second budget during the %s '
+            'phase.' % (budget, phase))
+        self.phase = phase
+        self.budget = budget
+
+
+class Deadline(object):
+    def __init__(self, budget=None, phase_budgets=None):
+        """
+        A time limit for startup, which bounds every request made before
+        it is finished.
+
+        :param budget: Time (in seconds) that startup may take in total,
+            or None for no limit.
+        :param phase_budgets: An optional dictionary limiting the time
+            (in seconds) that individual phases may take, within the
+            total budget.
+        """
+        self.budget = budget
+        self.phase_budgets = phase_budgets or {}
+        self.expires_at = None
+        if budget is not None:
+            self.expires_at = time.time() + budget
+        self.phase_expires_at = None
+        self.current = None
+
+    def remaining(self):
+        """
+        Time (in seconds) left in the current phase, or None if there is
+        no limit.
+        """
+        limits = [limit for limit in (self.expires_at, self.phase_expires_at)
+                  if limit is not None]
+        if not limits:
+            return None
+        return min(limits) - time.time()
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self):
+        if self.expired():
+            budget = self.phase_budgets.get(self.current, self.budget)
+            raise StartupTimeout(self.current, budget)
+
+    def timeout(self, timeout):
+        """
+        Clamp a requests timeout, either a number or a (connect, read)
+        tuple, to the time that is left.
+        """
+        self.check()
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if timeout is None:
+            return remaining
+        if isinstance(timeout, tuple):
+            return tuple(min(part, remaining) for part in timeout)
+        return min(timeout, remaining)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Run a startup phase, raising a StartupTimeout naming the phase if
+        the deadline passes before it is done. Errors raised once the
+        deadline has passed are assumed to be caused by it.
+        """
+        self.current = name
+        self.phase_expires_at = None
+        if name in self.phase_budgets:
+            self.phase_expires_at = time.time() + self.phase_budgets[name]
+        self.check()
+        try:
+            yield
+        except StartupTimeout:
+            raise
+        except Exception:
+            self.check()
+            raise
+        else:
+            self.check()
+        finally:
+            self.phase_expires_at = None
+
+    def finish(self):
+        """
+        Lift the deadline once startup is over.
+        """
+        self.expires_at = None
+        self.phase_expires_at = None
+        self.current = None
+
+
+def retry(fn, attempts, backoff, retryable, deadline=None):
+    """
+    Call fn, retrying up to `attempts` more times when it raises one of
+    the `retryable` exceptions.
+
+    Retries back off exponentially with full jitter, sleeping a random
+    time of up to backoff * 2 ** n seconds before retry n, and are never
+    made past the deadline.
+    """
+    for attempt in range(attempts + 1):
+        try:
+            return fn()
+        except retryable:
+            if attempt == attempts:
+                raise
+            delay = random.uniform(0, backoff * 2 ** attempt)
+            remaining = None if deadline is None else deadline.remaining()
+            if remaining is not None and delay >= remaining:
+                raise
+            time.sleep(delay)
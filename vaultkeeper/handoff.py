@@ -0,0 +1,79 @@
+import fcntl
+import os
+import threading
+
+MFD_CLOEXEC = 0x1
+MFD_ALLOW_SEALING = 0x2
+F_ADD_SEALS = 1033
+# F_SEAL_SEAL, F_SEAL_SHRINK, F_SEAL_GROW and F_SEAL_WRITE.
+ALL_SEALS = 0x1 | 0x2 | 0x4 | 0x8
+
+
+def memfd(content, name='vaultkeeper'):
+    """
+    An anonymous in-memory file holding content, sealed against any
+    further change and positioned at its start.
+    """
+    import ctypes
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    memfd_create = getattr(libc, 'memfd_create', None)
+    if memfd_create is None:
+        raise RuntimeError('The memfd output mode needs Linux 3.17 and '
+                           'glibc 2.27 or later.')
+    memfd_create.argtypes = [ctypes.c_char_p, ctypes.c_uint]
+    fd = memfd_create(name, MFD_CLOEXEC | MFD_ALLOW_SEALING)
+    if fd < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    try:
+        view = memoryview(content)
+        while view:
+            view = view[os.write(fd, view):]
+        fcntl.fcntl(fd, F_ADD_SEALS, ALL_SEALS)
+        os.lseek(fd, 0, os.SEEK_SET)
+    except Exception:
+        os.close(fd)
+        raise
+    return fd
+
+
+def pipe(content):
+    """
+    The read end of a pipe that is fed content and then closed. Content
+    is written from a background thread, as it may not fit in the pipe's
+    buffer before the reader starts.
+    """
+    read_fd, write_fd = os.pipe()
+    fcntl.fcntl(read_fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+    fcntl.fcntl(write_fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+
+    def feed():
+        try:
+            view = memoryview(content)
+            while view:
+                view = view[os.write(write_fd, view):]
+        except OSError:
+            # The reader went away without reading everything.
+            pass
+        finally:
+            os.close(write_fd)
+
+    writer = threading.Thread(target=feed)
+    writer.daemon = True
+    writer.start()
+    return read_fd
+
+
+def handoff_fd(mode, content):
+    """
+    A file descriptor from which a process can read content, for the
+    memfd or pipe output mode.
+    """
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    if mode == 'memfd':
+        return memfd(content)
+    if mode == 'pipe':
+        return pipe(content)
+    raise KeyError('Unknown output_mode: ' + mode)
@@ -0,0 +1,55 @@
+import json
+import os
+import threading
+
+from checkpoint import fernet
+from writer import atomic_write
+
+
+class KVCache(object):
+    def __init__(self, path=None, key=None):
+        """
+        Remember the last read of each KV version 2 secret along with its
+        version, so that a secret is only read again once it has changed.
+
+        :param path: An optional file in which to keep the cache across
+            agent restarts. It holds secrets, so it is encrypted, and only
+            ever written with mode 0600.
+        :param key: The Fernet key that encrypts the file, which is needed
+            along with path.
+        """
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.cipher = None
+        if path is not None:
+            self.cipher = fernet(key)
+        if path is not None and os.path.exists(path):
+            from cryptography.fernet import InvalidToken
+
+            try:
+                with open(path, 'rb') as f:
+                    self.entries = json.loads(self.cipher.decrypt(f.read()))
+            except (ValueError, InvalidToken):
+                # An unreadable cache is only a missed optimisation.
+                self.entries = {}
+
+    def get(self, vault_path, version):
+        """
+        The cached response for vault_path, if it is at the given version.
+        """
+        with self.lock:
+            entry = self.entries.get(vault_path)
+        if entry is None or entry['version'] != version:
+            return None
+        return entry['response']
+
+    def put(self, vault_path, response):
+        version = response['data']['metadata']['version']
+        with self.lock:
+            self.entries[vault_path] = {'version': version,
+                                        'response': response}
+            if self.path is not None:
+                atomic_write(self.path,
+                             self.cipher.encrypt(json.dumps(self.entries)),
+                             0o600)
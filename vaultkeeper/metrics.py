@@ -0,0 +1,179 @@
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (key, str(value).replace('"', '\\"'))
+                          for key, value in sorted(labels.items())) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.lock = threading.Lock()
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.description),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+        for name, labels, value in self.samples():
+            lines.append(name + format_labels(labels) + ' '
+                         + format_value(value))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, description):
+        Metric.__init__(self, name, description)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, dict(key), value)
+                    for key, value in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, description, collect=None):
+        """
+        A metric which can go up and down.
+
+        :param collect: An optional function returning (labels, value)
+            pairs, which is called to read the gauge's values on every
+            scrape instead of using set().
+        """
+        Metric.__init__(self, name, description)
+        self.values = {}
+        self.collect = collect
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def samples(self):
+        if self.collect is not None:
+            return [(self.name, labels, value)
+                    for labels, value in self.collect()]
+        with self.lock:
+            return [(self.name, dict(key), value)
+                    for key, value in sorted(self.values.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, description)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total = self.values.get(
+                key, ([0] * len(self.buckets), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        output = []
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                labels = dict(key)
+                for bound, count in zip(self.buckets, counts):
+                    bucket_labels = dict(labels, le=format_value(bound))
+                    output.append((self.name + '_bucket', bucket_labels,
+                                   count))
+                output.append((self.name + '_sum', labels, total))
+                output.append((self.name + '_count', labels, counts[-1]))
+        return output
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return ''.join(metric.render() for metric in self.metrics)
+
+
+def serve_metrics(registry, address):
+    # Keeps the HTTP server modules off the startup path of agents that
+    # do not export metrics.
+    from metrics_server import start_server
+    return start_server(registry, address)
+
+
+class AgentMetrics(object):
+    def __init__(self, vaultkeeper):
+        """
+        The metrics exported by a Vaultkeeper agent.
+
+        :param vaultkeeper: The Vaultkeeper whose leases and startup
+            timings are reported.
+        """
+        self.vaultkeeper = vaultkeeper
+        self.registry = Registry()
+        self.request_duration = self.registry.register(Histogram(
+            'vaultkeeper_request_duration_seconds',
+            'Latency of Vault and Gatekeeper requests by operation.'))
+        self.request_failures = self.registry.register(Counter(
+            'vaultkeeper_request_failures_total',
+            'Failed Vault and Gatekeeper requests by operation.'))
+        self.renewal_lag = self.registry.register(Histogram(
+            'vaultkeeper_renewal_lag_seconds',
+            'Time between a lease becoming due for renewal and its renewal.'))
+        self.child_start = self.registry.register(Gauge(
+            'vaultkeeper_child_start_seconds',
+            'Time from the start of startup until the child was spawned.'))
+        self.child_restarts = self.registry.register(Counter(
+            'vaultkeeper_child_restarts_total',
+            'Restarts of supervised processes by process.'))
+        self.registry.register(Gauge(
+            'vaultkeeper_lease_expiry_seconds',
+            'Time until each lease expires.',
+            collect=self.lease_expiries))
+        self.registry.register(Gauge(
+            'vaultkeeper_startup_phase_seconds',
+            'Duration of each startup phase.',
+            collect=self.startup_phases))
+
+    def lease_expiries(self):
+        now = time.time()
+        leases = list((self.vaultkeeper.secrets or {}).itervalues())
+        if self.vaultkeeper.vault_secret is not None:
+            leases.append(self.vaultkeeper.vault_secret)
+        return [({'secret': lease.name}, lease.expires_at - now)
+                for lease in leases if lease.expires_at is not None]
+
+    def startup_phases(self):
+        return [({'phase': phase}, duration) for phase, duration
+                in self.vaultkeeper.timings.items()]
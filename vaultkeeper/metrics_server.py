@@ -0,0 +1,52 @@
+import os
+import threading
+import SocketServer
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TCPMetricsServer(SocketServer.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class UnixMetricsServer(SocketServer.ThreadingMixIn,
+                        SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        SocketServer.UnixStreamServer.server_bind(self)
+
+
+def start_server(registry, address):
+    """
+    Serve the registry's metrics at /metrics from a background thread.
+
+    :param address: Either "host:port" or "unix:<path>".
+    """
+    if address.startswith('unix:'):
+        server = UnixMetricsServer(address[len('unix:'):], MetricsHandler)
+    else:
+        host, _, port = address.rpartition(':')
+        server = TCPMetricsServer((host, int(port)), MetricsHandler)
+    server.registry = registry
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
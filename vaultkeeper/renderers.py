@@ -0,0 +1,219 @@
+import json
+import os
+import pipes
+import re
+import urllib
+from string import Formatter
+
+import secret
+
+
+def scalar(value):
+    if isinstance(value, basestring):
+        return value.encode('utf-8')
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return str(value)
+
+
+def fields(cred):
+    return dict((key, scalar(value))
+                for key, value in cred.printable().iteritems())
+
+
+def env_name(*parts):
+    return re.sub(r'[^A-Z0-9_]', '_', '_'.join(parts).upper())
+
+
+class JsonRenderer(object):
+    def __init__(self, path):
+        """
+        Render every secret into a single JSON array.
+
+        :param path: The output file.
+        """
+        self.path = path
+
+    def render(self, secrets):
+        data = secret.printable_secrets(secrets)
+        return [(self.path, json.dumps(data, sort_keys=True))]
+
+
+class SecretFilesRenderer(object):
+    def __init__(self, directory):
+        """
+        Render each field of each secret into its own file, at
+        <directory>/<id>/<field>, holding only the raw value.
+
+        :param directory: The directory to write secrets into.
+        """
+        self.directory = directory
+
+    def render(self, secrets):
+        output = []
+        for name, cred in sorted(secrets.iteritems()):
+            for key, value in sorted(fields(cred).iteritems()):
+                path = os.path.join(self.directory, name, key)
+                output.append((path, value))
+        return output
+
+
+class PgpassRenderer(object):
+    def __init__(self, path):
+        """
+        Render database secrets in PostgreSQL's .pgpass format.
+
+        :param path: The output file.
+        """
+        self.path = path
+
+    def escape(self, value):
+        return value.replace('\\', '\\\\').replace(':', '\\:')
+
+    def address(self, endpoint):
+        endpoint = endpoint.split('://', 1)[-1]
+        hostport, _, database = endpoint.partition('/')
+        host, _, port = hostport.partition(':')
+        return host or '*', port or '*', database or '*'
+
+    def render(self, secrets):
+        lines = []
+        for name, cred in sorted(secrets.iteritems()):
+            if not isinstance(cred, secret.Database):
+                continue
+            values = self.address(cred.endpoint)
+            values += (cred.username, cred.password)
+            lines.append(':'.join(self.escape(scalar(v)) for v in values))
+        return [(self.path, ''.join(line + '\n' for line in lines))]
+
+
+class DotenvRenderer(object):
+    def __init__(self, path, prefix=''):
+        """
+        Render every field of every secret as a shell-quoted
+        <PREFIX><ID>_<FIELD>=value line.
+
+        :param path: The output file.
+        :param prefix: A prefix for every variable name.
+        """
+        self.path = path
+        self.prefix = prefix
+
+    def render(self, secrets):
+        lines = []
+        for name, cred in sorted(secrets.iteritems()):
+            for key, value in sorted(fields(cred).iteritems()):
+                lines.append(env_name(self.prefix + name, key)
+                             + '=' + pipes.quote(value))
+        return [(self.path, ''.join(line + '\n' for line in lines))]
+
+
+class TemplateRenderer(object):
+    def __init__(self, path, secret_id, template, quote=None):
+        """
+        Render one secret through a format string, such as a connection
+        URL, e.g. "postgres://{username}:{password}@{endpoint}".
+
+        The template is parsed once up front, so rendering only joins
+        literals and field values.
+
+        :param path: The output file.
+        :param secret_id: The id of the secret to render.
+        :param template: A str.format-style template over the secret's
+            printable fields, without conversions or format specs.
+        :param quote: The fields to percent-encode, such as the username
+            and password of a URL, or None to render every field as is.
+        """
+        self.path = path
+        self.secret_id = secret_id
+        self.quote = set(quote or [])
+        self.parts = []
+        for literal, field, spec, conversion in Formatter().parse(template):
+            if spec or conversion:
+                raise KeyError('The template for ' + path + ' formats '
+                               + field + ' with a conversion or format '
+                               + 'spec, which are not supported.')
+            self.parts.append((scalar(literal), field))
+
+    def render(self, secrets):
+        if self.secret_id not in secrets:
+            return []
+        values = fields(secrets[self.secret_id])
+        output = []
+        for literal, field in self.parts:
+            output.append(literal)
+            if field is not None:
+                try:
+                    value = values[field]
+                except KeyError:
+                    raise RuntimeError('The secret ' + self.secret_id
+                                       + ' has no field ' + field
+                                       + ' to render into ' + self.path)
+                if field in self.quote:
+                    value = urllib.quote(value, safe='')
+                output.append(value)
+        return [(self.path, ''.join(output))]
+
+
+class EnvironmentMapping(object):
+    def __init__(self, mappings):
+        """
+        Map the fields of secrets to environment variables, by backend.
+
+        :param mappings: A dictionary from backend names, or "*" for any
+            other backend, to a dictionary with a "name" template for the
+            variables, over {id}, {backend} and {field}, and optionally the
+            list of "fields" to map, which defaults to all of them. Names
+            are upper-cased, and anything but letters, digits and
+            underscores in them is replaced with underscores.
+        """
+        self.mappings = mappings
+
+    def variables(self, secrets):
+        env = {}
+        for name, cred in sorted(secrets.iteritems()):
+            mapping = self.mappings.get(cred.backend, self.mappings.get('*'))
+            if mapping is None:
+                continue
+            values = fields(cred)
+            template = mapping.get('name', '{id}_{field}')
+            for field in mapping.get('fields', sorted(values)):
+                if field not in values:
+                    raise RuntimeError('The secret ' + name + ' has no '
+                                       + 'field ' + field + ' to put in '
+                                       + 'the environment.')
+                key = template.format(id=name, backend=cred.backend,
+                                      field=field)
+                env[str(env_name(key))] = values[field]
+        return env
+
+
+def build_renderers(renderer_configs, output_path):
+    """
+    Build the configured renderers, defaulting to a single JSON file at
+    output_path.
+
+    :param renderer_configs: A list of renderer options, each with a
+        "type", or None.
+    :param output_path: The JSON output file used if no renderers are
+        configured.
+    """
+    if renderer_configs is None:
+        return [JsonRenderer(output_path)]
+    built = []
+    for entry in renderer_configs:
+        options = dict(entry)
+        cls = classnames[str(options.pop('type'))]
+        built.append(cls(**options))
+    return built
+
+
+classnames = {
+    'json': JsonRenderer,
+    'files': SecretFilesRenderer,
+    'pgpass': PgpassRenderer,
+    'dotenv': DotenvRenderer,
+    'template': TemplateRenderer,
+}
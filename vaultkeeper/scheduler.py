@@ -0,0 +1,115 @@
+import hashlib
+import heapq
+import itertools
+import random
+import threading
+import time
+
+
+class RenewalScheduler(object):
+    def __init__(self, grace, jitter=0, splay=0, seed=None,
+                 rotation_window=None):
+        """
+        Order leases by the time at which they enter their renewal window.
+
+        Renewals can be brought forward by a random jitter and by a fixed
+        splay, so that agents started together do not renew together.
+        Neither ever brings a renewal forward by more than the lease's
+        grace window.
+
+        :param grace: Time (in seconds) before a lease's expiry under
+            which it is due for renewal.
+        :param jitter: Maximum random time (in seconds) by which to bring
+            each renewal forward.
+        :param splay: Maximum time (in seconds) by which to bring every
+            renewal forward, at a phase fixed for this scheduler.
+        :param seed: A string, such as a task ID, from which to derive the
+            splay's phase. A random phase is used if this is None.
+        :param rotation_window: Time (in seconds) before a lease's maximum
+            TTL at which it is due for rotation. Defaults to grace.
+        """
+        self.grace = grace
+        self.rotation_window = grace
+        if rotation_window is not None:
+            self.rotation_window = rotation_window
+        self.jitter = jitter
+        self.splay = splay
+        self.random = random.Random()
+        if seed is None:
+            self.phase = self.random.random()
+        else:
+            digest = hashlib.sha256(seed.encode('utf-8')).hexdigest()
+            self.phase = int(digest[:8], 16) / float(2 ** 32)
+        self.queue = []
+        self.entries = {}
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def window(self, lease):
+        # Never let the grace window swallow the whole lease, otherwise a
+        # short lease would be renewed on every pass.
+        return min(self.grace, lease.lease_duration / 2.0)
+
+    def renewal_time(self, lease):
+        due = lease.expires_at - self.window(lease)
+        max_expiry = lease.max_expiry()
+        if max_expiry is not None:
+            due = min(due, max_expiry - self.rotation_window)
+        return due
+
+    def spread(self, lease):
+        """
+        Time (in seconds) by which to bring the next renewal forward.
+        """
+        offset = self.splay * self.phase + self.jitter * self.random.random()
+        return min(offset, self.window(lease))
+
+    def schedule(self, lease, due=None):
+        """
+        Queue a lease for renewal, replacing any earlier entry for it.
+
+        :param due: The time at which the lease is due, instead of the
+            start of its renewal window.
+        """
+        with self.lock:
+            self.discard_locked(lease)
+            if not lease.renewable:
+                return
+            if due is None:
+                due = self.renewal_time(lease) - self.spread(lease)
+            entry = [due, next(self.counter), lease]
+            self.entries[id(lease)] = entry
+            heapq.heappush(self.queue, entry)
+
+    def discard(self, lease):
+        with self.lock:
+            self.discard_locked(lease)
+
+    def discard_locked(self, lease):
+        entry = self.entries.pop(id(lease), None)
+        if entry is not None:
+            entry[2] = None
+
+    def prune_locked(self):
+        while self.queue and self.queue[0][2] is None:
+            heapq.heappop(self.queue)
+
+    def next_due(self):
+        with self.lock:
+            self.prune_locked()
+            if not self.queue:
+                return None
+            return self.queue[0][0]
+
+    def pop_due(self, now=None):
+        if now is None:
+            now = time.time()
+        due = []
+        with self.lock:
+            self.prune_locked()
+            while self.queue and self.queue[0][0] <= now:
+                lease = heapq.heappop(self.queue)[2]
+                del self.entries[id(lease)]
+                due.append(lease)
+                self.prune_locked()
+        return due
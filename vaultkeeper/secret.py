@@ -3,6 +3,10 @@ import time
 
 
 class Secret(object):
+    # Whether reads of this secret are static, and so may be shared
+    # between agents through the node-local secret cache.
+    cacheable = False
+
     def __init__(self, name, backend):
         self.name = name
         self.backend = backend
@@ -14,21 +18,70 @@ class Secret(object):
         self.lease_duration = None
         self.max_ttl = None
         self.renewable = None
+        self.lease_increment = None
+        self.expires_at = None
+        self.required = True
+        self.fetched = False
+        self.spec = None
+        self.issued_at = None
+        self.response = None
 
     def constructor(self, **kwargs):
+        self.spec = kwargs
         self.endpoint = kwargs['endpoint']
         self.vault_path = kwargs['vault_path']
         self.policy = kwargs['policy']
+        self.lease_increment = kwargs.get('lease_increment')
+        self.max_ttl = kwargs.get('max_ttl')
+        self.required = kwargs.get('required', True)
 
     def add_secret(self, hvac_data):
-        self.lease_id = hvac_data['lease_id']
-        self.lease_duration = hvac_data['lease_duration']
+        self.fetched = True
+        self.response = hvac_data
         self.renewable = hvac_data['renewable']
+        self.update_lease(hvac_data['lease_id'],
+                          hvac_data['lease_duration'])
+        self.issued_at = self.last_renewed
 
     def update_lease(self, lease_id, lease_duration):
         self.lease_id = lease_id
         self.lease_duration = lease_duration
         self.last_renewed = time.time()
+        self.expires_at = self.last_renewed + lease_duration
+
+    def max_expiry(self):
+        """
+        The time past which the lease cannot be renewed, if known.
+        """
+        if self.max_ttl is None or self.issued_at is None:
+            return None
+        return self.issued_at + self.max_ttl
+
+    def checkpoint(self):
+        """
+        The state needed for another agent to resume this lease.
+        """
+        return {
+                'spec': self.spec,
+                'response': self.response,
+                'lease_id': self.lease_id,
+                'lease_duration': self.lease_duration,
+                'last_renewed': self.last_renewed,
+                'issued_at': self.issued_at,
+                'max_ttl': self.max_ttl
+        }
+
+    def resume(self, state):
+        """
+        Take over a lease from the state saved by checkpoint().
+        """
+        self.add_secret(state['response'])
+        self.lease_id = state['lease_id']
+        self.lease_duration = state['lease_duration']
+        self.last_renewed = state['last_renewed']
+        self.expires_at = self.last_renewed + self.lease_duration
+        self.issued_at = state['issued_at']
+        self.max_ttl = state['max_ttl']
 
     def printable(self):
         return {
@@ -43,17 +96,42 @@ class Secret(object):
         }
 
 
-class Generic(Secret):
+class KeyValue(Secret):
+    cacheable = True
+
     def __init__(self, name, backend):
         Secret.__init__(self, name, backend)
-        self.secret_value = None
+        self.kv_version = 1
 
     def constructor(self, **kwargs):
         Secret.constructor(self, **kwargs)
+        self.kv_version = kwargs.get('kv_version', 1)
+
+    def metadata_path(self):
+        """
+        The path of a KV version 2 secret's metadata, which holds its
+        current version.
+        """
+        mount, _, path = self.vault_path.partition('/data/')
+        return mount + '/metadata/' + path
+
+    def kv_data(self, hvac_data):
+        if self.kv_version == 2:
+            return hvac_data['data']['data']
+        return hvac_data['data']
+
+
+class Generic(KeyValue):
+    def __init__(self, name, backend):
+        KeyValue.__init__(self, name, backend)
+        self.secret_value = None
+
+    def constructor(self, **kwargs):
+        KeyValue.constructor(self, **kwargs)
 
     def add_secret(self, hvac_data):
         Secret.add_secret(self, hvac_data)
-        self.secret_value = hvac_data['data']
+        self.secret_value = self.kv_data(hvac_data)
 
     def printable(self):
         output = Secret.printable(self)
@@ -61,17 +139,17 @@ class Generic(Secret):
         return output
 
 
-class Token(Secret):
+class Token(KeyValue):
     def __init__(self, name, backend):
-        Secret.__init__(self, name, backend)
+        KeyValue.__init__(self, name, backend)
         self.token_value = None
 
     def constructor(self, **kwargs):
-        Secret.constructor(self, **kwargs)
+        KeyValue.constructor(self, **kwargs)
 
     def add_secret(self, hvac_data):
         Secret.add_secret(self, hvac_data)
-        self.token_value = hvac_data['data']['token']
+        self.token_value = self.kv_data(hvac_data)['token']
 
     def update_ttl(self, ttl):
         self.lease_duration = ttl
@@ -86,17 +164,39 @@ class UnwrappedToken(Secret):
     def __init__(self, name, backend):
         Secret.__init__(self, name, backend)
         self.token_value = None
+        self.verified = False
 
     def constructor(self, **kwargs):
         Secret.constructor(self, **kwargs)
 
     def add_secret(self, hvac_data):
-        self.lease_duration = hvac_data['auth']['lease_duration']
+        self.response = hvac_data
         self.renewable = hvac_data['auth']['renewable']
         self.token_value = hvac_data['auth']['client_token']
+        self.update_ttl(hvac_data['auth']['lease_duration'])
 
     def update_ttl(self, ttl):
         self.lease_duration = ttl
+        self.last_renewed = time.time()
+        self.expires_at = self.last_renewed + ttl
+        self.verified = True
+
+    def resume(self, state):
+        Secret.resume(self, state)
+        # A resumed token has to be checked with Vault before it is used.
+        self.verified = False
+
+    def verify(self):
+        self.verified = True
+
+    def invalidate(self):
+        self.verified = False
+
+    def is_valid(self):
+        """
+        Whether the token can be assumed valid without asking Vault.
+        """
+        return self.verified and time.time() < self.expires_at
 
     def printable(self):
         output = Secret.printable(self)
@@ -198,6 +298,32 @@ class AWS(Secret):
         return output
 
 
+def register_backend(name, cls):
+    """
+    Make a Secret subclass available to the secrets configuration under
+    the given backend name.
+    """
+    classnames[name] = cls
+
+
+def backend_class(name):
+    """
+    Look up the Secret subclass for a backend. Backends that are not built
+    in are loaded from the ``vaultkeeper.backends`` entry point group, the
+    first time a configured secret uses them.
+    """
+    if name not in classnames:
+        import pkg_resources
+
+        for entry_point in pkg_resources.iter_entry_points(
+                'vaultkeeper.backends', name):
+            register_backend(name, entry_point.load())
+            break
+        else:
+            raise KeyError('Unknown secret backend: ' + name)
+    return classnames[name]
+
+
 def parse_secret_file(config_path):
     with open(config_path) as consumer_config:
         data = json.load(consumer_config)
@@ -205,7 +331,7 @@ def parse_secret_file(config_path):
     for entry in data:
         name = entry['id']
         backend = entry['backend']
-        cls = classnames[str(backend)]
+        cls = backend_class(str(backend))
         inst = cls(name, backend)
         inst.constructor(**entry)
         secrets[name] = inst
@@ -217,7 +343,7 @@ def parse_secret_data(data):
     for entry in data:
         name = entry['id']
         backend = entry['backend']
-        cls = classnames[str(backend)]
+        cls = backend_class(str(backend))
         inst = cls(name, backend)
         inst.constructor(**entry)
         secrets[name] = inst
@@ -226,12 +352,13 @@ def parse_secret_data(data):
 
 def printable_secrets(secrets):
     output = []
-    for name, secret in secrets.iteritems():
+    for name, secret in sorted(secrets.iteritems()):
         output.append(secret.printable())
     return output
 
 
 classnames = {
+    'generic': Generic,
     'database': Database,
     'postgresql': PostgreSQL,
     'rabbitmq': RabbitMQ,
@@ -0,0 +1,66 @@
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+
+class DeadlineSession(requests.Session):
+    """
+    A session whose requests never outlive its deadline, if it has one.
+    """
+    deadline = None
+    # Used instead of the mounted adapters while the deadline is running,
+    # as urllib3 would give each retry all of the time that is left.
+    deadline_adapter = None
+
+    def running(self):
+        return (self.deadline is not None
+                and self.deadline.remaining() is not None)
+
+    def request(self, method, url, **kwargs):
+        if self.deadline is not None:
+            kwargs['timeout'] = self.deadline.timeout(kwargs.get('timeout'))
+        return requests.Session.request(self, method, url, **kwargs)
+
+    def get_adapter(self, url):
+        if self.deadline_adapter is not None and self.running():
+            return self.deadline_adapter
+        return requests.Session.get_adapter(self, url)
+
+    def close(self):
+        requests.Session.close(self)
+        if self.deadline_adapter is not None:
+            self.deadline_adapter.close()
+
+
+def build_session(configs):
+    """
+    Build the keep-alive session shared by the Vault and Gatekeeper
+    clients.
+
+    Only connections that could not be opened are retried here. A read
+    that timed out or failed may have issued credentials, so retrying it
+    is left to Vaultkeeper.retryable_errors, which knows which secrets
+    can safely be read again.
+
+    :param configs: A ConfigParser object.
+    """
+    retries = Retry(total=configs.http_retries,
+                    connect=configs.http_retries,
+                    read=0,
+                    status=0,
+                    backoff_factor=configs.http_retry_backoff,
+                    respect_retry_after_header=False,
+                    raise_on_status=False)
+    pool_size = max(configs.http_pool_size, configs.fetch_workers)
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size,
+                          max_retries=retries)
+    session = DeadlineSession()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.deadline_adapter = HTTPAdapter(pool_connections=2,
+                                           pool_maxsize=pool_size)
+    return session
+
+
+def request_timeout(configs):
+    return (configs.http_connect_timeout, configs.http_read_timeout)
@@ -0,0 +1,82 @@
+"""
+Import-time benchmarks for Vaultkeeper.
+
+Imports a module in a fresh interpreter and reports the cumulative time
+spent importing each module it pulls in, in the manner of Python 3's
+-X importtime:
+
+    $ python -m vaultkeeper.tests.bench_imports vaultkeeper.vaultkeeper
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+# Run in the child interpreter. Wraps __import__ to time the first import
+# of every module, including the modules that it imports in turn.
+PROBE = '''
+import json, sys, time
+import __builtin__
+
+timings = []
+real_import = __builtin__.__import__
+
+
+def timed_import(name, *args, **kwargs):
+    before = set(sys.modules)
+    start = time.time()
+    try:
+        return real_import(name, *args, **kwargs)
+    finally:
+        elapsed = time.time() - start
+        if len(sys.modules) > len(before):
+            timings.append((name, elapsed))
+
+__builtin__.__import__ = timed_import
+start = time.time()
+__import__(sys.argv[1])
+total = time.time() - start
+__builtin__.__import__ = real_import
+print(json.dumps({'total': total, 'timings': timings,
+                  'modules': sorted(sys.modules)}))
+'''
+
+
+def import_profile(module):
+    """
+    Import module in a fresh interpreter, returning the total import
+    time, the time taken by each import statement that loaded new modules,
+    and every module loaded by the end.
+
+    The interpreter ignores PYTHON* environment variables, so that nothing
+    but the import under test is loaded, and runs from the source tree.
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-E', '-c', PROBE, module], cwd=ROOT)
+    return json.loads(output)
+
+
+def report(profile, limit=15):
+    lines = ['total: %.1f ms' % (profile['total'] * 1000)]
+    timings = sorted(profile['timings'], key=lambda t: -t[1])[:limit]
+    for name, elapsed in timings:
+        lines.append('%8.1f ms  %s' % (elapsed * 1000, name))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('module', nargs='?', default='vaultkeeper.vaultkeeper',
+                        help='The module to import.')
+    parser.add_argument('--limit', type=int, default=15,
+                        help='Number of slowest imports to show.')
+    args = parser.parse_args()
+    print(report(import_profile(args.module), args.limit))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Startup latency benchmarks for Vaultkeeper.
+
+Drives Vaultkeeper.start_subprocess against FakeVault and FakeGatekeeper
+with an injected per-request latency, and reports how long each startup
+phase takes. Runs offline:
+
+    $ python -m vaultkeeper.tests.bench_startup --secrets 1,8 --latency 0.05
+"""
+import argparse
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+
+import responses
+
+from ..configparser import ConfigParser
+from ..vaultkeeper import Vaultkeeper
+from .. import secret
+from .fake_vault import FakeVault
+from .fake_gatekeeper import FakeGatekeeper
+
+FAKE_VAULT_URL = 'https://test-vault-instance.net'
+FAKE_GATEKEEPER_URL = 'https://test-gatekeeper-instance.net'
+PHASES = ('warmup', 'gatekeeper', 'unwrap', 'creds', 'write', 'spawn',
+          'total')
+
+
+def configs(output_path, fetch_workers, pipelined):
+    cfgs = ConfigParser()
+    cfgs.load_data({
+        'entry_cmd': 'true',
+        'output_path': output_path,
+        'refresh_interval': 30,
+        'renewal_grace': 15,
+        'fetch_workers': fetch_workers,
+        'pipelined_startup': pipelined,
+    })
+    return cfgs
+
+
+def secrets(count):
+    return secret.parse_secret_data([{
+        'id': 'creds' + str(i),
+        'backend': 'database',
+        'endpoint': 'https://test-postgres-instance.net',
+        'vault_path': 'database/creds/postgresql_myschema_readonly',
+        'schema': 'myschema',
+        'policy': 'read'
+    } for i in range(count)])
+
+
+def run_startup(secret_count, latency, fetch_workers, pipelined, workdir):
+    """
+    Start a child process once and return the time taken by each phase.
+    """
+    fake_vault = FakeVault()
+    fake_vault.setup()
+    fake_vault.latency = latency
+    fake_gatekeeper = FakeGatekeeper()
+    fake_gatekeeper.setup()
+    fake_gatekeeper.latency = latency
+
+    vaultkeeper = Vaultkeeper(
+        configs=configs(workdir + '/creds.json', fetch_workers, pipelined),
+        secrets=secrets(secret_count),
+        taskid='purple-rain-486-ab24134bed3423f124937',
+        appname='purple-rain-486',
+        vault_addr=FAKE_VAULT_URL,
+        gatekeeper_addr=FAKE_GATEKEEPER_URL
+    )
+    vaultkeeper.setup()
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as r:
+        fake_gatekeeper.add_handlers(r, FAKE_GATEKEEPER_URL)
+        fake_vault.add_handlers(r, FAKE_VAULT_URL)
+        start = time.time()
+        vaultkeeper.start_subprocess()
+        total = time.time() - start
+        vaultkeeper.app.wait()
+        vaultkeeper.cleanup()
+
+    timings = OrderedDict(vaultkeeper.timings)
+    timings['total'] = total
+    return timings
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def run_benchmarks(secret_counts, latencies, fetch_workers, repeat,
+                   pipelined=False):
+    """
+    Return the median phase timings for every combination of secret
+    count, injected latency and fetch worker count.
+    """
+    workdir = tempfile.mkdtemp()
+    results = []
+    try:
+        for count in secret_counts:
+            for latency in latencies:
+                for workers in fetch_workers:
+                    runs = [run_startup(count, latency, workers,
+                                        pipelined, workdir)
+                            for _ in range(repeat)]
+                    timings = OrderedDict(
+                        (phase, median([run.get(phase, 0) for run in runs]))
+                        for phase in PHASES)
+                    results.append(((count, latency, workers), timings))
+    finally:
+        shutil.rmtree(workdir)
+    return results
+
+
+def report(results):
+    header = ['secrets', 'latency', 'workers'] + list(PHASES)
+    lines = [''.join('%12s' % column for column in header)]
+    for (count, latency, workers), timings in results:
+        row = ['%12d' % count, '%12.3f' % latency, '%12d' % workers]
+        row.extend('%11.1fms' % (timings[phase] * 1000)
+                   for phase in PHASES)
+        lines.append(''.join(row))
+    return '\n'.join(lines)
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def float_list(value):
+    return [float(v) for v in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--secrets', type=int_list, default=[1, 4, 16],
+                        help='Comma-separated secret counts.')
+    parser.add_argument('--latency', type=float_list, default=[0, 0.02],
+                        help='Comma-separated per-request latencies (s).')
+    parser.add_argument('--workers', type=int_list, default=[1, 8],
+                        help='Comma-separated fetch worker counts.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per combination; the median is shown.')
+    parser.add_argument('--pipelined', action='store_true',
+                        help='Warm up Vault connections during startup.')
+    args = parser.parse_args()
+    print(report(run_benchmarks(args.secrets, args.latency,
+                                args.workers, args.repeat, args.pipelined)))
+
+
+if __name__ == '__main__':
+    main()
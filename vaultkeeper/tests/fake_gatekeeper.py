@@ -1,9 +1,11 @@
 from fake_vault import FakeVault
 import json
+import time
 
 
 class FakeGatekeeper(object):
     def setup(self):
+        self.latency = 0
         self.fake_vault = FakeVault()
         self.fake_vault.setup()
         self.vault_token = '00000000-0000-0000-0000-000000000000'
@@ -35,8 +37,14 @@ class FakeGatekeeper(object):
         }
         return (200, headers, json.dumps(body))
 
+    def delayed(self, callback):
+        def respond(request):
+            time.sleep(self.latency)
+            return callback(request)
+        return respond
+
     def add_handlers(self, responses, fake_gatekeeper_url):
         responses.add_callback(responses.POST,
                                fake_gatekeeper_url + '/token',
-                               callback=self.get_token,
+                               callback=self.delayed(self.get_token),
                                content_type='application/json')
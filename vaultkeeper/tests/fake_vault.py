@@ -1,10 +1,12 @@
 import re
 import json
+import time
 from urlparse import urlparse
 
 
 class FakeVault(object):
     def setup(self):
+        self.latency = 0
         self.policies = {
             'default': {
                 'auth/token/lookup-self': {
@@ -22,6 +24,9 @@ class FakeVault(object):
                 'sys/leases/renew': {
                     'capabilities': ['update']
                 },
+                'sys/leases/revoke': {
+                    'capabilities': ['update']
+                },
                 'cubbyhole/*': {
                     'capabilities': [
                         'create',
@@ -45,6 +50,15 @@ class FakeVault(object):
                 'database/creds/postgresql_myschema_readonly': {
                     'capabilities': ['read', 'list']
                 },
+                'secret/django-consumer/config': {
+                    'capabilities': ['read']
+                },
+                'kv/data/django-consumer/app': {
+                    'capabilities': ['read']
+                },
+                'kv/metadata/django-consumer/app': {
+                    'capabilities': ['read']
+                },
             },
             'gatekeeper': {
                 'auth/token/create': {
@@ -105,6 +119,8 @@ class FakeVault(object):
             }
         }
 
+        self.kv_version = 1
+
         self.leases = {
             'database/creds/postgresql_myschema_readonly/lease-id1': {
                 'lease_duration': 100,
@@ -234,6 +250,86 @@ class FakeVault(object):
         headers = {'content-type': 'application/json'}
         return (200, headers, json.dumps(body))
 
+    def get_generic_secret(self, request):
+        header_data = request.headers
+        client_token = header_data['x-vault-token']
+        path = urlparse(request.url).path[4:]
+        action = 'read'
+        params = {}
+        if not self.token_authorised(client_token, path, action, params):
+            return (403, {}, {})
+
+        body = {
+            'lease_id': '',
+            'lease_duration': 2764800,
+            'renewable': False,
+            'data': {
+                'debug': 'false',
+                'secret_key': 'testsecretkey1'
+            }
+        }
+        headers = {'content-type': 'application/json'}
+        return (200, headers, json.dumps(body))
+
+    def get_kv_secret(self, request):
+        header_data = request.headers
+        client_token = header_data['x-vault-token']
+        path = urlparse(request.url).path[4:]
+        action = 'read'
+        params = {}
+        if not self.token_authorised(client_token, path, action, params):
+            return (403, {}, {})
+
+        body = {
+            'lease_id': '',
+            'lease_duration': 0,
+            'renewable': False,
+            'data': {
+                'data': {
+                    'settings': 'version' + str(self.kv_version)
+                },
+                'metadata': {
+                    'version': self.kv_version
+                }
+            }
+        }
+        headers = {'content-type': 'application/json'}
+        return (200, headers, json.dumps(body))
+
+    def get_kv_metadata(self, request):
+        header_data = request.headers
+        client_token = header_data['x-vault-token']
+        path = urlparse(request.url).path[4:]
+        action = 'read'
+        params = {}
+        if not self.token_authorised(client_token, path, action, params):
+            return (403, {}, {})
+
+        body = {
+            'lease_id': '',
+            'lease_duration': 0,
+            'renewable': False,
+            'data': {
+                'current_version': self.kv_version
+            }
+        }
+        headers = {'content-type': 'application/json'}
+        return (200, headers, json.dumps(body))
+
+    def capabilities_self(self, request):
+        header_data = request.headers
+        client_token = header_data['x-vault-token']
+        path = json.loads(request.body)['path']
+        capabilities = ['deny']
+        if self.token_authorised(client_token, path, 'read', {}):
+            capabilities = ['read']
+        headers = {'content-type': 'application/json'}
+        body = {
+            'capabilities': capabilities,
+            path: capabilities
+        }
+        return (200, headers, json.dumps(body))
+
     def expire_lease(self):
         self.leases = {
             'database/creds/postgresql_myschema_readonly/lease-id1': {
@@ -296,6 +392,8 @@ class FakeVault(object):
         if self.leases[leaseid]['expired']:
             return (403, {}, {})
 
+        if 'max_ttl' in self.leases[leaseid]:
+            increment = min(increment, self.leases[leaseid]['max_ttl'])
         self.leases[leaseid]['lease_duration'] = increment
         headers = {'content-type': 'application/json'}
         body = {
@@ -305,6 +403,19 @@ class FakeVault(object):
         }
         return (200, headers, json.dumps(body))
 
+    def revoke_lease(self, request):
+        header_data = request.headers
+        client_token = header_data['x-vault-token']
+        path = urlparse(request.url).path[4:]
+        action = 'update'
+        params = {}
+        if not self.token_authorised(client_token, path, action, params):
+            return (403, {}, {})
+
+        data = json.loads(request.body)
+        self.leases.pop(data['lease_id'], None)
+        return (204, {}, '')
+
     def lookup_self(self, request):
         header_data = request.headers
         client_token = header_data['x-vault-token']
@@ -334,44 +445,93 @@ class FakeVault(object):
         del self.tokens[client_token]
         return (200, {}, {})
 
+    def delayed(self, callback):
+        def respond(request):
+            time.sleep(self.latency)
+            return callback(request)
+        return respond
+
+    def health(self, request):
+        headers = {'content-type': 'application/json'}
+        body = {
+            'initialized': True,
+            'sealed': False,
+            'standby': False
+        }
+        return (200, headers, json.dumps(body))
+
     def add_handlers(self, responses, fake_vault_url):
         responses.add_callback(responses.POST,
                                fake_vault_url + '/v1/auth/token/create',
-                               callback=self.create_wrapped_token,
+                               callback=self.delayed(
+                                   self.create_wrapped_token),
                                content_type='application/json')
         responses.add_callback(responses.GET,
                                fake_vault_url
                                + ('/v1/database/creds/'
                                   'postgresql_myschema_readonly'),
-                               callback=self.get_db_creds,
+                               callback=self.delayed(self.get_db_creds),
                                content_type='application/json')
 
         responses.add_callback(responses.POST,
                                fake_vault_url + '/v1/auth/token/renew-self',
-                               callback=self.renew_self,
+                               callback=self.delayed(self.renew_self),
                                content_type='application/json')
 
         responses.add_callback(responses.POST,
                                fake_vault_url + '/v1/sys/wrapping/unwrap',
-                               callback=self.unwrap_client_token,
+                               callback=self.delayed(self.unwrap_client_token),
                                content_type='application/json')
 
         responses.add_callback(responses.POST,
                                fake_vault_url + '/v1/auth/token/renew',
-                               callback=self.renew_lease,
+                               callback=self.delayed(self.renew_lease),
                                content_type='application/json')
 
         responses.add_callback(responses.GET,
                                fake_vault_url + '/v1/auth/token/lookup-self',
-                               callback=self.lookup_self,
+                               callback=self.delayed(self.lookup_self),
                                content_type='application/json')
 
         responses.add_callback(responses.PUT,
                                fake_vault_url + '/v1/sys/leases/renew',
-                               callback=self.renew_lease,
+                               callback=self.delayed(self.renew_lease),
+                               content_type='application/json')
+
+        responses.add_callback(responses.PUT,
+                               fake_vault_url + '/v1/sys/leases/revoke',
+                               callback=self.delayed(self.revoke_lease),
                                content_type='application/json')
 
         responses.add_callback(responses.PUT,
                                fake_vault_url + '/v1/auth/token/revoke-self',
-                               callback=self.revoke_self,
+                               callback=self.delayed(self.revoke_self),
+                               content_type='application/json')
+
+        responses.add_callback(responses.GET,
+                               fake_vault_url
+                               + '/v1/secret/django-consumer/config',
+                               callback=self.delayed(self.get_generic_secret),
+                               content_type='application/json')
+
+        responses.add_callback(responses.GET,
+                               fake_vault_url
+                               + '/v1/kv/data/django-consumer/app',
+                               callback=self.delayed(self.get_kv_secret),
+                               content_type='application/json')
+
+        responses.add_callback(responses.GET,
+                               fake_vault_url
+                               + '/v1/kv/metadata/django-consumer/app',
+                               callback=self.delayed(self.get_kv_metadata),
+                               content_type='application/json')
+
+        responses.add_callback(responses.POST,
+                               fake_vault_url + '/v1/sys/capabilities-self',
+                               callback=self.delayed(self.capabilities_self),
+                               content_type='application/json')
+
+        responses.add_callback(responses.HEAD,
+                               fake_vault_url + '/v1/sys/health',
+                               callback=self.delayed(self.health),
                                content_type='application/json')
@@ -0,0 +1,27 @@
+from vaultkeeper import secret
+from vaultkeeper.configparser import ConfigParser
+
+
+def configs(**overrides):
+    data = {
+        'entry_cmd': '',
+        'output_path': '',
+        'refresh_interval': 30,
+        'renewal_grace': 15,
+    }
+    data.update(overrides)
+    cfgs = ConfigParser()
+    cfgs.load_data(data)
+    return cfgs
+
+
+def unwrapped_token(ttl=3600):
+    token = secret.UnwrappedToken('vault_token', 'token')
+    token.add_secret({
+        'auth': {
+            'client_token': '00000000-0000-0000-0000-000000000001',
+            'lease_duration': ttl,
+            'renewable': True
+        }
+    })
+    return token
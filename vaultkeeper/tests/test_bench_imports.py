@@ -0,0 +1,14 @@
+from bench_imports import import_profile, report
+
+# Modules that only some agents need, which importing the agent must not
+# load up front.
+DEFERRED = ('hvac', 'requests', 'BaseHTTPServer', 'SocketServer',
+            'pkg_resources')
+
+
+class TestBenchImports(object):
+    def test_agent_defers_heavy_imports(self):
+        profile = import_profile('vaultkeeper.vaultkeeper')
+        loaded = [name for name in DEFERRED if name in profile['modules']]
+        assert loaded == []
+        assert 'vaultkeeper.vaultkeeper' in report(profile)
@@ -0,0 +1,11 @@
+from bench_startup import PHASES, run_benchmarks, report
+
+
+class TestBenchStartup(object):
+    def test_reports_every_phase(self):
+        results = run_benchmarks([2], [0], [2], 1, pipelined=True)
+        (params, timings), = results
+        assert params == (2, 0, 2)
+        assert list(timings.keys()) == list(PHASES)
+        assert all(value >= 0 for value in timings.values())
+        assert 'gatekeeper' in report(results)
@@ -0,0 +1,97 @@
+import socket
+import threading
+
+import pytest
+import responses
+
+from vaultkeeper.cache import SecretCache, SecretCacheServer, read_cached
+from fake_vault import FakeVault
+
+CONSUMER_TOKEN = '00000000-0000-0000-0000-000000000001'
+OTHER_TOKEN = '10000000-1000-1000-1000-100000000000'
+CONFIG_PATH = 'secret/django-consumer/config'
+
+
+def vault_calls(path):
+    return [c for c in responses.calls if c.request.url.endswith(path)]
+
+
+class TestSecretCache(object):
+    def setup(self):
+        self.fake_vault = FakeVault()
+        self.fake_vault.setup()
+        self.fake_vault_url = 'https://test-vault-instance.net'
+        self.cache = SecretCache(self.fake_vault_url, 60)
+
+    @responses.activate
+    def test_reads_once_per_ttl(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        first = self.cache.read(CONSUMER_TOKEN, CONFIG_PATH)
+        second = self.cache.read(CONSUMER_TOKEN, CONFIG_PATH)
+        assert first == second
+        assert first['data']['secret_key'] == 'testsecretkey1'
+        assert len(responses.calls) == 1
+
+    @responses.activate
+    def test_checks_policy_of_other_tokens(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.cache.read(CONSUMER_TOKEN, CONFIG_PATH)
+        with pytest.raises(RuntimeError):
+            self.cache.read(OTHER_TOKEN, CONFIG_PATH)
+        assert len(vault_calls(CONFIG_PATH)) == 1
+        assert len(vault_calls('/v1/sys/capabilities-self')) == 1
+
+    @responses.activate
+    def test_concurrent_misses_share_one_read(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.fake_vault.latency = 0.2
+        results = []
+
+        def read():
+            results.append(self.cache.read(CONSUMER_TOKEN, CONFIG_PATH))
+
+        threads = [threading.Thread(target=read) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        assert len(results) == 10
+        assert len(vault_calls(CONFIG_PATH)) == 1
+
+    @responses.activate
+    def test_evicts_expired_reads(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.cache.ttl = 0
+        self.cache.read(CONSUMER_TOKEN, CONFIG_PATH)
+        self.cache.read(CONSUMER_TOKEN, CONFIG_PATH)
+        assert len(vault_calls(CONFIG_PATH)) == 2
+
+
+class TestSecretCacheServer(object):
+    def setup(self):
+        self.fake_vault = FakeVault()
+        self.fake_vault.setup()
+        self.fake_vault_url = 'https://test-vault-instance.net'
+
+    @responses.activate
+    def test_serves_reads_over_socket(self, tmpdir):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        path = tmpdir.join('cache.sock').strpath
+        server = SecretCacheServer(
+            path, SecretCache(self.fake_vault_url, 60))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            data = read_cached(path, CONSUMER_TOKEN, CONFIG_PATH, 5)
+            assert data['data']['secret_key'] == 'testsecretkey1'
+            with pytest.raises(RuntimeError):
+                read_cached(path, OTHER_TOKEN, CONFIG_PATH, 5)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_unreachable_socket(self, tmpdir):
+        with pytest.raises(socket.error):
+            read_cached(tmpdir.join('missing.sock').strpath,
+                        CONSUMER_TOKEN, CONFIG_PATH, 5)
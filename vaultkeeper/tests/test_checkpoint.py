@@ -0,0 +1,92 @@
+import os
+import stat
+
+import pytest
+
+from vaultkeeper import secret
+from helpers import unwrapped_token
+
+fernet = pytest.importorskip('cryptography.fernet')
+
+from vaultkeeper.checkpoint import Checkpoint  # noqa: E402
+
+
+def fetched_secrets():
+    secrets = secret.parse_secret_data([{
+        'id': 'creds1',
+        'backend': 'database',
+        'endpoint': 'https://test-postgres-instance.net',
+        'vault_path': 'database/creds/postgresql_myschema_readonly',
+        'schema': 'myschema',
+        'policy': 'read',
+        'max_ttl': 600
+    }, {
+        'id': 'config',
+        'backend': 'generic',
+        'endpoint': 'https://test-vault-instance.net',
+        'vault_path': 'secret/config',
+        'policy': 'read'
+    }])
+    secrets['creds1'].add_secret({
+        'lease_id': 'database/creds/postgresql_myschema_readonly/lease-id1',
+        'lease_duration': 100,
+        'renewable': True,
+        'data': {'username': 'testuser1', 'password': 'testpass1'}
+    })
+    secrets['config'].add_secret({
+        'lease_id': '',
+        'lease_duration': 2764800,
+        'renewable': False,
+        'data': {'key': 'value'}
+    })
+    return secrets
+
+
+class TestCheckpoint(object):
+    def setup(self):
+        self.key = fernet.Fernet.generate_key()
+
+    def test_round_trip(self, tmpdir):
+        path = tmpdir.join('checkpoint').strpath
+        secrets = fetched_secrets()
+        Checkpoint(path, self.key).save(unwrapped_token(), secrets)
+        state = Checkpoint(path, self.key).load()
+        assert state['token']['response']['auth']['client_token'] == (
+            '00000000-0000-0000-0000-000000000001')
+        assert state['secrets'].keys() == ['creds1']
+
+        spec = state['secrets']['creds1']['spec']
+        cred = secret.parse_secret_data([spec])['creds1']
+        cred.resume(state['secrets']['creds1'])
+        original = secrets['creds1']
+        assert cred.username == 'testuser1'
+        assert cred.lease_id == original.lease_id
+        assert cred.expires_at == original.expires_at
+        assert cred.max_expiry() == original.max_expiry()
+
+    def test_file_is_encrypted_and_private(self, tmpdir):
+        path = tmpdir.join('checkpoint').strpath
+        Checkpoint(path, self.key).save(unwrapped_token(), fetched_secrets())
+        with open(path) as f:
+            assert 'testpass1' not in f.read()
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    def test_other_keys_cannot_load(self, tmpdir):
+        path = tmpdir.join('checkpoint').strpath
+        Checkpoint(path, self.key).save(unwrapped_token(), fetched_secrets())
+        other = Checkpoint(path, fernet.Fernet.generate_key())
+        assert other.load() is None
+
+    def test_missing_checkpoint(self, tmpdir):
+        checkpoint = Checkpoint(tmpdir.join('checkpoint').strpath, self.key)
+        assert checkpoint.load() is None
+        checkpoint.clear()
+
+    def test_resumed_token_is_verified_before_use(self, tmpdir):
+        path = tmpdir.join('checkpoint').strpath
+        Checkpoint(path, self.key).save(unwrapped_token(), fetched_secrets())
+        state = Checkpoint(path, self.key).load()
+        resumed = secret.UnwrappedToken('vault_token', 'token')
+        resumed.resume(state['token'])
+        assert resumed.token_value == '00000000-0000-0000-0000-000000000001'
+        assert not resumed.is_valid()
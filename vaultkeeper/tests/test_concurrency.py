@@ -0,0 +1,52 @@
+import threading
+import time
+
+import pytest
+
+from vaultkeeper.concurrency import map_concurrently, BudgetExceeded
+
+
+class TestMapConcurrently(object):
+    def test_results_keep_item_order(self):
+        results = map_concurrently(lambda x: x * 2, range(10), 4)
+        assert results == [x * 2 for x in range(10)]
+
+    def test_first_error_is_raised_without_waiting(self):
+        release = threading.Event()
+
+        def fetch(item):
+            if item == 'bad':
+                raise RuntimeError('bad secret')
+            release.wait(5)
+            return item
+
+        with pytest.raises(RuntimeError) as excinfo:
+            map_concurrently(fetch, ['slow', 'bad'], 2)
+        assert not release.is_set()
+        release.set()
+        assert 'bad secret' in str(excinfo.value)
+
+    def test_started_items_can_be_waited_for(self):
+        finished = []
+
+        def fetch(item):
+            if item == 'bad':
+                raise RuntimeError('bad secret')
+            time.sleep(0.1)
+            finished.append(item)
+            return item
+
+        with pytest.raises(RuntimeError):
+            map_concurrently(fetch, ['slow', 'bad'], 2, wait=True)
+        assert finished == ['slow']
+
+    def test_timeout_abandons_slow_items(self):
+        release = threading.Event()
+
+        def revoke(item):
+            release.wait(5)
+            return item
+
+        with pytest.raises(BudgetExceeded):
+            map_concurrently(revoke, ['a', 'b'], 2, timeout=0.05)
+        release.set()
@@ -0,0 +1,255 @@
+import threading
+import time
+
+import pytest
+
+from vaultkeeper.child import Child, Handover, RestartPolicy, stop_processes
+from vaultkeeper.configparser import ConfigParser
+from vaultkeeper.core import AgentCore, EventLoop, WAKE
+
+
+class DueScheduler(object):
+    def next_due(self):
+        return time.time() - 1
+
+
+class Agent(object):
+    """
+    The parts of Vaultkeeper that AgentCore drives, with a lease that is
+    always due for renewal.
+    """
+    def __init__(self, entry_cmd, renew, restart=None):
+        self.configs = ConfigParser()
+        self.configs.refresh_interval = 0.05
+        self.children = [Child('app', entry_cmd, restart=restart)]
+        self.scheduler = DueScheduler()
+        self.renew_due = renew
+        self.cleaned_up = False
+        self.stopping = False
+        self.restarted = 0
+
+    def schedule_renewals(self):
+        pass
+
+    def reload_due(self):
+        return False
+
+    def retirement_due(self, now):
+        return False
+
+    def next_wakeup(self):
+        return 0
+
+    def restart_delay(self, child):
+        if self.stopping:
+            return None
+        return child.restart_delay()
+
+    def restart_child(self, child):
+        self.restarted += 1
+        child.respawn()
+
+    def stop_children(self):
+        for child in self.children:
+            child.stop(1)
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+
+class TestEventLoop(object):
+    def test_task_runs_once_at_a_time(self):
+        loop = EventLoop(2)
+        release = threading.Event()
+        assert loop.submit('renew', release.wait, 5)
+        assert not loop.submit('renew', release.wait, 5)
+        release.set()
+        assert loop.next_event(5) == (WAKE, ())
+        assert loop.submit('renew', release.wait, 5)
+
+
+class TestRestartPolicy(object):
+    def test_restarts_after_failure(self):
+        policy = RestartPolicy(2)
+        assert policy.allows(1, 0)
+        assert policy.allows(-9, 1)
+        assert not policy.allows(0, 0)
+        assert not policy.allows(1, 2)
+
+    def test_only_listed_exit_codes_restart(self):
+        policy = RestartPolicy(2, exit_codes=[0, 75])
+        assert policy.allows(0, 0)
+        assert policy.allows(75, 0)
+        assert not policy.allows(1, 0)
+
+    def test_backoff_doubles_up_to_limit(self):
+        policy = RestartPolicy(10, backoff=1, max_backoff=5)
+        assert [policy.delay(n) for n in range(4)] == [1, 2, 4, 5]
+
+
+class TestStopProcesses(object):
+    def test_processes_are_stopped_together(self):
+        children = [Child(name, "sh -c 'trap \"\" TERM; exec sleep 5'")
+                    for name in ('app', 'worker', 'cron')]
+        for child in children:
+            child.spawn()
+        time.sleep(0.1)
+        start = time.time()
+        stop_processes([child.process for child in children], 0.3)
+        assert time.time() - start < 0.6
+        assert [child.process.poll() for child in children] == [-9] * 3
+
+
+class TestHandover(object):
+    def test_exec_probe(self):
+        child = Child('app', 'sleep 5')
+        process = child.spawn()
+        try:
+            assert Handover('exec:true').ready(process)
+            assert not Handover('exec:false').ready(process)
+            assert Handover('exec:kill -0 {pid}').ready(process)
+        finally:
+            child.stop(1)
+
+    def test_tcp_probe_is_rejected(self):
+        with pytest.raises(KeyError) as excinfo:
+            Handover('tcp:127.0.0.1:8000')
+        assert 'cannot tell' in str(excinfo.value)
+
+    def test_new_process_takes_over_once_ready(self):
+        child = Child('app', 'sleep 5',
+                      handover=Handover('exec:true', 2, 0.01))
+        old = child.spawn()
+        try:
+            assert child.hand_over(1)
+            assert old.poll() is not None
+            assert child.replaced(old)
+            assert child.process.poll() is None
+        finally:
+            child.stop(1)
+
+    def test_old_process_is_kept_if_new_is_not_ready(self):
+        child = Child('app', 'sleep 5',
+                      handover=Handover('exec:false', 0.1, 0.01))
+        old = child.spawn()
+        try:
+            assert not child.hand_over(1)
+            assert child.process is old
+            assert old.poll() is None
+        finally:
+            child.stop(1)
+
+
+class TestAgentCore(object):
+    def test_exit_is_noticed_during_slow_renewal(self):
+        release = threading.Event()
+        agent = Agent('true', lambda: release.wait(5))
+        agent.children[0].spawn()
+        start = time.time()
+        assert AgentCore(agent).run() == 0
+        assert time.time() - start < 2
+        assert not release.is_set()
+        assert agent.cleaned_up
+        release.set()
+
+    def test_failed_renewal_is_raised(self):
+        def renew():
+            raise RuntimeError('Vault is sealed')
+
+        agent = Agent('sleep 5', renew)
+        agent.children[0].spawn()
+        try:
+            with pytest.raises(RuntimeError) as excinfo:
+                AgentCore(agent).run()
+        finally:
+            agent.stop_children()
+        assert 'sealed' in str(excinfo.value)
+
+    def test_exited_process_is_restarted(self):
+        agent = Agent('false', lambda: None,
+                      RestartPolicy(2, backoff=0.01))
+        agent.children[0].spawn()
+        assert AgentCore(agent).run() == 1
+        assert agent.restarted == 2
+        assert agent.cleaned_up
+
+    def test_failed_restart_shuts_down(self):
+        agent = Agent('false', lambda: None,
+                      RestartPolicy(2, backoff=0.01))
+        child = agent.children[0]
+        child.spawn()
+
+        def restart_child(child):
+            agent.restarted += 1
+            child.restarts += 1
+            raise OSError(2, 'No such file or directory')
+
+        agent.restart_child = restart_child
+        assert AgentCore(agent).run() == 1
+        assert agent.restarted == 2
+        assert agent.cleaned_up
+
+    def test_unlisted_exit_code_shuts_down(self):
+        agent = Agent('false', lambda: None,
+                      RestartPolicy(2, backoff=0.01, exit_codes=[75]))
+        agent.children[0].spawn()
+        assert AgentCore(agent).run() == 1
+        assert agent.restarted == 0
+
+    def test_stopping_cancels_pending_restart(self):
+        agent = Agent('false', lambda: None, RestartPolicy(2, backoff=5))
+        agent.children[0].spawn()
+        core = AgentCore(agent)
+
+        def stop():
+            agent.stopping = True
+            core.wake()
+
+        timer = threading.Timer(0.2, stop)
+        timer.start()
+        start = time.time()
+        assert core.run() == 1
+        assert time.time() - start < 2
+        assert agent.restarted == 0
+
+    def test_replaced_process_exit_is_expected(self):
+        agent = Agent('sleep 5', lambda: None)
+        child = agent.children[0]
+        child.handover = Handover('exec:true', 2, 0.01)
+        child.spawn()
+        core = AgentCore(agent)
+        result = []
+        thread = threading.Thread(target=lambda: result.append(core.run()))
+        thread.start()
+        time.sleep(0.1)
+        assert child.hand_over(1)
+        core.loop.watch(child)
+        time.sleep(0.2)
+        assert thread.is_alive()
+        child.process.terminate()
+        thread.join(5)
+        assert result == [-15]
+
+    def test_handover_does_not_hold_up_renewals(self):
+        release = threading.Event()
+        renewals = []
+        agent = Agent('sleep 5', lambda: renewals.append(time.time()))
+        child = agent.children[0]
+
+        def hand_over(child):
+            child.handover_due = False
+            release.wait(5)
+
+        agent.hand_over = hand_over
+        child.handover_due = True
+        child.spawn()
+        thread = threading.Thread(target=AgentCore(agent).run)
+        thread.start()
+        try:
+            time.sleep(0.3)
+            assert not child.handover_due
+            assert len(renewals) > 1
+        finally:
+            release.set()
+            child.stop(1)
+            thread.join(5)
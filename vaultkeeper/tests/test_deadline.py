@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+from vaultkeeper.deadline import Deadline, StartupTimeout, retry
+
+
+class TestDeadline(object):
+    def test_no_budget_leaves_timeouts_alone(self):
+        deadline = Deadline()
+        assert deadline.remaining() is None
+        assert deadline.timeout((5, 30)) == (5, 30)
+        assert deadline.timeout(None) is None
+
+    def test_timeouts_are_clamped_to_time_left(self):
+        deadline = Deadline(2)
+        connect, read = deadline.timeout((1, 30))
+        assert connect == 1
+        assert 1 < read <= 2
+        assert 1 < deadline.timeout(None) <= 2
+
+    def test_phase_budget_limits_phase(self):
+        deadline = Deadline(10, {'creds': 1})
+        with deadline.phase('creds'):
+            assert deadline.remaining() <= 1
+        assert deadline.remaining() > 1
+
+    def test_slow_phase_is_named(self):
+        deadline = Deadline(10, {'creds': 0.05})
+        with pytest.raises(StartupTimeout) as excinfo:
+            with deadline.phase('creds'):
+                time.sleep(0.1)
+        assert excinfo.value.phase == 'creds'
+        assert excinfo.value.budget == 0.05
+        assert 'creds phase' in str(excinfo.value)
+
+    def test_errors_after_expiry_become_timeouts(self):
+        deadline = Deadline(0.05)
+        with pytest.raises(StartupTimeout) as excinfo:
+            with deadline.phase('unwrap'):
+                time.sleep(0.1)
+                raise IOError('read timed out')
+        assert excinfo.value.phase == 'unwrap'
+
+    def test_errors_within_budget_are_kept(self):
+        deadline = Deadline(10)
+        with pytest.raises(IOError):
+            with deadline.phase('unwrap'):
+                raise IOError('connection refused')
+
+    def test_finish_lifts_deadline(self):
+        deadline = Deadline(0.01)
+        deadline.finish()
+        time.sleep(0.02)
+        deadline.check()
+
+
+class TestRetry(object):
+    def failing(self, failures):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            if len(calls) <= failures:
+                raise IOError('unavailable')
+            return 'ok'
+        return fn, calls
+
+    def test_retries_until_success(self):
+        fn, calls = self.failing(2)
+        assert retry(fn, 3, 0.001, IOError) == 'ok'
+        assert len(calls) == 3
+
+    def test_gives_up_after_attempts(self):
+        fn, calls = self.failing(5)
+        with pytest.raises(IOError):
+            retry(fn, 2, 0.001, IOError)
+        assert len(calls) == 3
+
+    def test_other_errors_are_not_retried(self):
+        fn, calls = self.failing(1)
+        with pytest.raises(IOError):
+            retry(fn, 3, 0.001, KeyError)
+        assert len(calls) == 1
+
+    def test_does_not_sleep_past_deadline(self):
+        fn, calls = self.failing(5)
+        start = time.time()
+        with pytest.raises(IOError):
+            retry(fn, 5, 10, IOError, Deadline(0.5))
+        assert time.time() - start < 0.5
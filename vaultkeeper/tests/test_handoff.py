@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from vaultkeeper.handoff import handoff_fd
+
+
+def read_all(fd):
+    chunks = []
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            return ''.join(chunks)
+        chunks.append(chunk)
+
+
+class TestHandoff(object):
+    def test_memfd_holds_content(self):
+        fd = handoff_fd('memfd', '{"creds1": {}}')
+        try:
+            assert read_all(fd) == '{"creds1": {}}'
+        finally:
+            os.close(fd)
+
+    def test_memfd_is_sealed(self):
+        fd = handoff_fd('memfd', 'secret')
+        try:
+            with pytest.raises(OSError):
+                os.write(fd, 'tampered')
+        finally:
+            os.close(fd)
+
+    def test_pipe_streams_content_larger_than_buffer(self):
+        content = 'x' * (1 << 20)
+        fd = handoff_fd('pipe', content)
+        try:
+            assert read_all(fd) == content
+        finally:
+            os.close(fd)
+
+    def test_unknown_mode(self):
+        with pytest.raises(KeyError):
+            handoff_fd('tmpfile', 'secret')
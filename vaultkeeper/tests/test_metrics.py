@@ -0,0 +1,65 @@
+import socket
+
+import requests
+
+from vaultkeeper import metrics
+
+
+def registry():
+    reg = metrics.Registry()
+    histogram = reg.register(metrics.Histogram(
+        'request_seconds', 'Request latency.', buckets=(0.1, 1)))
+    histogram.observe(0.05, operation='read')
+    histogram.observe(0.5, operation='read')
+    reg.register(metrics.Counter('failures_total', 'Failures.')).inc(
+        operation='read')
+    reg.register(metrics.Gauge(
+        'expiry_seconds', 'Expiry.',
+        collect=lambda: [({'secret': 'creds1'}, 90)]))
+    return reg
+
+
+class TestMetrics(object):
+    def test_render(self):
+        assert registry().render() == '\n'.join([
+            '# HELP request_seconds Request latency.',
+            '# TYPE request_seconds histogram',
+            'request_seconds_bucket{le="0.1",operation="read"} 1.0',
+            'request_seconds_bucket{le="1.0",operation="read"} 2.0',
+            'request_seconds_bucket{le="+Inf",operation="read"} 2.0',
+            'request_seconds_sum{operation="read"} 0.55',
+            'request_seconds_count{operation="read"} 2.0',
+            '# HELP failures_total Failures.',
+            '# TYPE failures_total counter',
+            'failures_total{operation="read"} 1.0',
+            '# HELP expiry_seconds Expiry.',
+            '# TYPE expiry_seconds gauge',
+            'expiry_seconds{secret="creds1"} 90.0',
+            ''])
+
+    def test_serve_tcp(self):
+        server = metrics.serve_metrics(registry(), '127.0.0.1:0')
+        try:
+            url = 'http://127.0.0.1:%d' % server.server_address[1]
+            resp = requests.get(url + '/metrics')
+            assert resp.status_code == 200
+            assert 'expiry_seconds{secret="creds1"} 90.0' in resp.text
+            assert requests.get(url + '/').status_code == 404
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_serve_unix_socket(self, tmpdir):
+        path = tmpdir.join('metrics.sock').strpath
+        server = metrics.serve_metrics(registry(), 'unix:' + path)
+        try:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(path)
+            client.sendall('GET /metrics HTTP/1.0\r\n\r\n')
+            response = ''.join(iter(lambda: client.recv(4096), ''))
+            client.close()
+            assert response.startswith('HTTP/1.0 200')
+            assert 'failures_total{operation="read"} 1.0' in response
+        finally:
+            server.shutdown()
+            server.server_close()
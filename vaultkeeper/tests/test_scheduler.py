@@ -0,0 +1,90 @@
+import time
+
+from vaultkeeper import secret
+from vaultkeeper.scheduler import RenewalScheduler
+
+
+def lease(name, duration, renewable=True):
+    s = secret.Secret(name, 'database')
+    s.add_secret({
+        'lease_id': name + '/lease-id',
+        'lease_duration': duration,
+        'renewable': renewable
+    })
+    return s
+
+
+class TestRenewalScheduler(object):
+    def test_orders_by_expiry(self):
+        scheduler = RenewalScheduler(15)
+        long_lease = lease('long', 3600)
+        short_lease = lease('short', 100)
+        scheduler.schedule(long_lease)
+        scheduler.schedule(short_lease)
+        assert scheduler.next_due() == short_lease.expires_at - 15
+
+    def test_only_pops_leases_in_grace_window(self):
+        scheduler = RenewalScheduler(15)
+        long_lease = lease('long', 3600)
+        short_lease = lease('short', 100)
+        scheduler.schedule(long_lease)
+        scheduler.schedule(short_lease)
+        assert scheduler.pop_due(time.time()) == []
+        assert scheduler.pop_due(time.time() + 90) == [short_lease]
+        assert scheduler.next_due() == long_lease.expires_at - 15
+
+    def test_skips_non_renewable_leases(self):
+        scheduler = RenewalScheduler(15)
+        scheduler.schedule(lease('static', 100, renewable=False))
+        assert scheduler.next_due() is None
+
+    def test_grace_is_capped_for_short_leases(self):
+        scheduler = RenewalScheduler(15)
+        short_lease = lease('short', 10)
+        scheduler.schedule(short_lease)
+        assert scheduler.next_due() == short_lease.expires_at - 5
+
+    def test_reschedule_replaces_entry(self):
+        scheduler = RenewalScheduler(15)
+        short_lease = lease('short', 100)
+        scheduler.schedule(short_lease)
+        short_lease.update_lease(short_lease.lease_id, 3600)
+        scheduler.schedule(short_lease)
+        assert scheduler.pop_due(time.time() + 90) == []
+        assert scheduler.next_due() == short_lease.expires_at - 15
+
+    def test_discard(self):
+        scheduler = RenewalScheduler(15)
+        short_lease = lease('short', 100)
+        scheduler.schedule(short_lease)
+        scheduler.discard(short_lease)
+        assert scheduler.next_due() is None
+
+    def test_jitter_brings_renewal_forward_within_window(self):
+        scheduler = RenewalScheduler(15, jitter=10)
+        for _ in range(50):
+            long_lease = lease('long', 3600)
+            scheduler.schedule(long_lease)
+            deadline = long_lease.expires_at - 15
+            assert deadline - 10 <= scheduler.next_due() <= deadline
+
+    def test_spread_is_capped_at_grace_window(self):
+        scheduler = RenewalScheduler(15, jitter=100, splay=100)
+        short_lease = lease('short', 10)
+        scheduler.schedule(short_lease)
+        assert scheduler.next_due() >= short_lease.expires_at - 10
+
+    def test_splay_phase_follows_seed(self):
+        first = RenewalScheduler(15, splay=10, seed='app-1')
+        again = RenewalScheduler(15, splay=10, seed='app-1')
+        other = RenewalScheduler(15, splay=10, seed='app-2')
+        long_lease = lease('long', 3600)
+        assert first.spread(long_lease) == again.spread(long_lease)
+        assert first.spread(long_lease) != other.spread(long_lease)
+
+    def test_max_ttl_brings_renewal_forward(self):
+        scheduler = RenewalScheduler(15, rotation_window=60)
+        long_lease = lease('long', 3600)
+        long_lease.max_ttl = 600
+        scheduler.schedule(long_lease)
+        assert scheduler.next_due() == long_lease.issued_at + 540
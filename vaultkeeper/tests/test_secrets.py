@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+from vaultkeeper import secret
+from helpers import unwrapped_token
+
+
+class TestUnwrappedToken(object):
+    def test_valid_after_unwrap(self):
+        token = unwrapped_token()
+        assert token.is_valid()
+        assert token.expires_at > time.time()
+
+    def test_invalid_once_expired(self):
+        token = unwrapped_token(ttl=0)
+        assert not token.is_valid()
+
+    def test_renewal_revalidates(self):
+        token = unwrapped_token()
+        token.invalidate()
+        assert not token.is_valid()
+        token.update_ttl(30)
+        assert token.is_valid()
+        assert token.lease_duration == 30
+
+
+class TestParseSecretData(object):
+    def test_secrets_are_required_by_default(self):
+        secrets = secret.parse_secret_data([{
+            'id': 'default',
+            'backend': 'database',
+            'endpoint': '10.0.0.1:5432/mydb',
+            'vault_path': 'database/creds/psql-rw',
+            'schema': 'public',
+            'policy': 'psql-rw',
+        }, {
+            'id': 'export',
+            'backend': 'aws',
+            'endpoint': 's3',
+            'vault_path': 'aws/creds/export',
+            'region': 'eu-west-1',
+            'policy': 'export',
+            'required': False
+        }])
+        assert secrets['default'].required
+        assert not secrets['export'].required
+
+    def test_registered_backend(self):
+        class Custom(secret.Generic):
+            pass
+
+        secret.register_backend('custom', Custom)
+        try:
+            secrets = secret.parse_secret_data([{
+                'id': 'custom',
+                'backend': 'custom',
+                'endpoint': '',
+                'vault_path': 'custom/creds/app',
+                'policy': 'app',
+            }])
+        finally:
+            del secret.classnames['custom']
+        assert isinstance(secrets['custom'], Custom)
+
+    def test_unknown_backend(self):
+        with pytest.raises(KeyError) as excinfo:
+            secret.parse_secret_data([{
+                'id': 'mystery',
+                'backend': 'mystery',
+                'endpoint': '',
+                'vault_path': 'mystery/creds/app',
+                'policy': 'app',
+            }])
+        assert 'mystery' in str(excinfo.value)
+
+
+class TestKeyValue(object):
+    def test_kv_version_2(self):
+        secrets = secret.parse_secret_data([{
+            'id': 'app',
+            'backend': 'token',
+            'endpoint': '',
+            'vault_path': 'kv/data/app/token',
+            'policy': 'app',
+            'kv_version': 2
+        }])
+        token = secrets['app']
+        assert token.metadata_path() == 'kv/metadata/app/token'
+        token.add_secret({
+            'lease_id': '',
+            'lease_duration': 0,
+            'renewable': False,
+            'data': {
+                'data': {'token': 'abc'},
+                'metadata': {'version': 3}
+            }
+        })
+        assert token.token_value == 'abc'
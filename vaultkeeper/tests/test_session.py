@@ -0,0 +1,42 @@
+import pytest
+from requests.packages.urllib3.exceptions import (MaxRetryError,
+                                                  ReadTimeoutError)
+
+from vaultkeeper.deadline import Deadline
+from vaultkeeper.session import build_session, request_timeout
+from helpers import configs
+
+
+class TestSession(object):
+    def test_defaults(self):
+        cfgs = configs()
+        adapter = build_session(cfgs).get_adapter('https://vault.net')
+        assert adapter._pool_maxsize == 10
+        assert adapter.max_retries.total == 0
+        assert request_timeout(cfgs) == (5, 30)
+
+    def test_pool_covers_fetch_workers(self):
+        cfgs = configs(fetch_workers=16, http_pool_size=4, http_retries=3)
+        adapter = build_session(cfgs).get_adapter('http://vault.net')
+        assert adapter._pool_maxsize == 16
+        assert adapter.max_retries.total == 3
+
+    def test_no_retries_within_deadline(self):
+        session = build_session(configs(http_retries=3))
+        session.deadline = Deadline(10)
+        adapter = session.get_adapter('https://vault.net')
+        assert adapter.max_retries.total == 0
+        session.deadline.finish()
+        adapter = session.get_adapter('https://vault.net')
+        assert adapter.max_retries.total == 3
+
+    def test_sent_requests_are_not_retried(self):
+        cfgs = configs(http_retries=3)
+        adapter = build_session(cfgs).get_adapter('http://vault.net')
+        retries = adapter.max_retries
+        assert retries.connect == 3
+        assert not retries.is_retry('GET', 500)
+        assert not retries.is_retry('GET', 503, has_retry_after=True)
+        with pytest.raises(MaxRetryError):
+            retries.increment('GET', '/v1/database/creds/role',
+                              error=ReadTimeoutError(None, '/', 'timed out'))
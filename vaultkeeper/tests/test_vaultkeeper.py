@@ -1,28 +1,24 @@
+import pytest
+import requests
 import responses
+import json
 import os
 import signal
+import socket
 import threading
+import time
 
 from ..vaultkeeper import Vaultkeeper
-from ..vaultkeeper import ConfigParser
+from vaultkeeper.deadline import StartupTimeout
 from vaultkeeper import secret
 from fake_vault import FakeVault
 from fake_gatekeeper import FakeGatekeeper
+from helpers import configs, unwrapped_token
 
 
-def configs():
-    data = {
-        'gatekeeper_addr': 'https://test-gatekeeper-instance.net',
-        'vault_addr': 'https://test-vault-instance.net',
-        'entry_cmd': '',
-        'output_path': '',
-        'refresh_interval': 30,
-        'renewal_grace': 15,
-    }
-
-    cfgs = ConfigParser()
-    cfgs.load_data(data)
-    return cfgs
+def agent_configs():
+    return configs(gatekeeper_addr='https://test-gatekeeper-instance.net',
+                   vault_addr='https://test-vault-instance.net')
 
 
 def secrets():
@@ -37,6 +33,11 @@ def secrets():
     return secret.parse_secret_data(data)
 
 
+def lookups(calls):
+    return [c for c in calls
+            if c.request.url.endswith('/v1/auth/token/lookup-self')]
+
+
 def vault_token():
     vault_secret = secret.Token('vault-token', 'token')
     vault_secret.add_secret({
@@ -54,7 +55,7 @@ def vault_token():
 
 class TestVaultkeeper(object):
     def setup(self):
-        self.configs = configs()
+        self.configs = agent_configs()
         self.secrets = secrets()
         self.vaultkeeper = Vaultkeeper(
             configs=self.configs,
@@ -78,6 +79,10 @@ class TestVaultkeeper(object):
         wrapped_token = self.vaultkeeper.get_wrapped_token()
         assert wrapped_token == '10000000-1000-1000-1000-100000000000'
 
+    def test_clients_share_session(self):
+        assert self.vaultkeeper.vault_client.session is (
+            self.vaultkeeper.session)
+
     @responses.activate
     def test_unwrap_token(self):
         self.fake_vault.add_handlers(responses, self.fake_vault_url)
@@ -114,6 +119,205 @@ class TestVaultkeeper(object):
 
         }])
 
+    @responses.activate
+    def test_get_creds_concurrently(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.configs.fetch_workers = 4
+        self.vaultkeeper.secrets = secret.parse_secret_data([{
+            'id': 'creds' + str(i),
+            'backend': 'database',
+            'endpoint': 'https://test-postgres-instance.net',
+            'vault_path': 'database/creds/postgresql_myschema_readonly',
+            'schema': 'myschema',
+            'policy': 'read'
+        } for i in range(8)])
+        self.vaultkeeper.get_creds()
+        for cred in self.vaultkeeper.secrets.itervalues():
+            assert cred.username == 'testuser1'
+            assert cred.password == 'testpass1'
+
+    @responses.activate
+    def test_get_creds_names_failing_secret(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.secrets.update(secret.parse_secret_data([{
+            'id': 'missing',
+            'backend': 'database',
+            'endpoint': 'https://test-postgres-instance.net',
+            'vault_path': 'database/creds/missing',
+            'schema': 'myschema',
+            'policy': 'read'
+        }]))
+        with pytest.raises(RuntimeError) as excinfo:
+            self.vaultkeeper.get_creds()
+        assert 'missing' in str(excinfo.value)
+
+    @responses.activate
+    def test_get_cred_trusts_valid_token_state(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.vault_secret = unwrapped_token()
+        self.vaultkeeper.get_creds()
+        assert len(responses.calls) == 1
+        assert lookups(responses.calls) == []
+
+    @responses.activate
+    def test_get_cred_verifies_expired_token_state(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.vault_secret = unwrapped_token(ttl=0)
+        self.vaultkeeper.get_creds()
+        assert len(lookups(responses.calls)) == 1
+
+    @responses.activate
+    def test_policy_denial_keeps_token_verified(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.vault_secret = unwrapped_token()
+        responses.add(responses.GET,
+                      self.fake_vault_url + '/v1/database/creds/denied',
+                      status=403)
+        denied = secret.parse_secret_data([{
+            'id': 'denied',
+            'backend': 'database',
+            'endpoint': 'https://test-postgres-instance.net',
+            'vault_path': 'database/creds/denied',
+            'schema': 'myschema',
+            'policy': 'read'
+        }])
+        with pytest.raises(RuntimeError):
+            self.vaultkeeper.get_creds(denied.values())
+        assert len(lookups(responses.calls)) == 1
+        responses.calls.reset()
+        self.vaultkeeper.get_creds()
+        assert lookups(responses.calls) == []
+
+    @responses.activate
+    def test_vault_requests_are_measured(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.vault_secret = unwrapped_token()
+        self.vaultkeeper.get_creds()
+        with pytest.raises(requests.ConnectionError):
+            self.vaultkeeper.get_cred('database/creds/missing')
+        output = self.vaultkeeper.metrics.registry.render()
+        assert ('vaultkeeper_request_duration_seconds_count'
+                '{operation="read"} 2.0') in output
+        assert ('vaultkeeper_request_failures_total'
+                '{operation="read"} 1.0') in output
+        assert 'vaultkeeper_lease_expiry_seconds{secret="creds1"}' in output
+
+    @responses.activate
+    def test_forbidden_invalidates_token_state(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.vault_secret = unwrapped_token()
+        self.fake_vault.tokens.clear()
+        with pytest.raises(RuntimeError):
+            self.vaultkeeper.get_cred(
+                'database/creds/postgresql_myschema_readonly')
+        assert not self.vaultkeeper.vault_secret.is_valid()
+
+    @responses.activate
+    def test_write_credentials_with_renderers(self, tmpdir):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.configs.renderers = [
+            {'type': 'json', 'path': tmpdir.join('creds.json').strpath},
+            {'type': 'files', 'directory': tmpdir.join('creds').strpath},
+        ]
+        self.vaultkeeper.get_creds()
+        assert self.vaultkeeper.write_credentials()
+        assert tmpdir.join('creds', 'creds1', 'username').read() == (
+            'testuser1')
+        assert not self.vaultkeeper.write_credentials()
+
+    @responses.activate
+    def test_static_secrets_fall_back_from_cache(self, tmpdir):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.vault_secret = unwrapped_token()
+        self.vaultkeeper.configs.cache_socket = (
+            tmpdir.join('missing.sock').strpath)
+        self.vaultkeeper.secrets = secret.parse_secret_data([{
+            'id': 'config',
+            'backend': 'generic',
+            'endpoint': '',
+            'vault_path': 'secret/django-consumer/config',
+            'policy': 'read'
+        }])
+        self.vaultkeeper.get_creds()
+        config = self.vaultkeeper.secrets['config']
+        assert config.secret_value['secret_key'] == 'testsecretkey1'
+
+    @responses.activate
+    def test_kv_secrets_are_only_read_when_changed(self, tmpdir,
+                                                   monkeypatch):
+        fernet = pytest.importorskip('cryptography.fernet')
+        monkeypatch.setenv('VAULTKEEPER_CHECKPOINT_KEY',
+                           fernet.Fernet.generate_key())
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.configs.kv_cache_path = (
+            tmpdir.join('kv.json').strpath)
+        self.vaultkeeper.vault_secret = unwrapped_token()
+        spec = [{
+            'id': 'app',
+            'backend': 'generic',
+            'endpoint': '',
+            'vault_path': 'kv/data/django-consumer/app',
+            'policy': 'read',
+            'kv_version': 2
+        }]
+
+        def reads():
+            return [c for c in responses.calls
+                    if '/v1/kv/data/' in c.request.url]
+
+        for kv_version, expected_reads in ((1, 1), (1, 1), (2, 2)):
+            # Every round is a fresh agent, sharing only the cache file.
+            self.fake_vault.kv_version = kv_version
+            self.vaultkeeper.setup()
+            self.vaultkeeper.vault_client.token = (
+                '00000000-0000-0000-0000-000000000001')
+            self.vaultkeeper.secrets = secret.parse_secret_data(spec)
+            self.vaultkeeper.get_creds()
+            app = self.vaultkeeper.secrets['app']
+            assert app.secret_value == {
+                'settings': 'version' + str(kv_version)}
+            assert len(reads()) == expected_reads
+        assert oct(tmpdir.join('kv.json').stat().mode & 0o777) == '0600'
+        assert 'version' not in tmpdir.join('kv.json').read()
+
+    @responses.activate
+    def test_kv_secrets_read_in_full_without_metadata_access(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        del self.fake_vault.policies['django-consumer'][
+            'kv/metadata/django-consumer/app']
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.vault_secret = unwrapped_token()
+        self.vaultkeeper.secrets = secret.parse_secret_data([{
+            'id': 'app',
+            'backend': 'generic',
+            'endpoint': '',
+            'vault_path': 'kv/data/django-consumer/app',
+            'policy': 'read',
+            'kv_version': 2
+        }])
+        self.vaultkeeper.get_creds()
+        assert self.vaultkeeper.secrets['app'].secret_value == {
+            'settings': 'version1'}
+
     @responses.activate
     def test_renew_token(self):
         self.fake_vault.add_handlers(responses, self.fake_vault_url)
@@ -123,6 +327,25 @@ class TestVaultkeeper(object):
         self.vaultkeeper.renew_token(30)
         assert self.vaultkeeper.vault_secret.lease_duration == 30
 
+    @responses.activate
+    def test_renew_due_only_renews_leases_in_grace_window(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.vault_secret = unwrapped_token(ttl=10)
+        self.vaultkeeper.configs.lease_increment = 60
+        self.vaultkeeper.schedule_renewals()
+
+        self.vaultkeeper.renew_due()
+        assert len(responses.calls) == 0
+
+        self.vaultkeeper.vault_secret.expires_at = time.time() + 1
+        self.vaultkeeper.schedule_renewals()
+        self.vaultkeeper.renew_due()
+        assert len(responses.calls) == 1
+        assert self.vaultkeeper.vault_secret.lease_duration == 60
+        assert self.vaultkeeper.next_wakeup() == 30
+
     @responses.activate
     def test_renew_lease(self):
         self.vaultkeeper.vault_client.token = (
@@ -143,6 +366,531 @@ class TestVaultkeeper(object):
         self.vaultkeeper.renew_lease(renew)
         assert renew.lease_duration == 300
 
+    @responses.activate
+    def test_renew_lease_detects_max_ttl(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.fake_vault.leases[
+            'database/creds/postgresql_myschema_readonly/lease-id1'][
+            'max_ttl'] = 50
+        self.vaultkeeper.configs.lease_increment = 300
+        self.vaultkeeper.get_creds()
+        renew = self.vaultkeeper.secrets['creds1']
+        self.vaultkeeper.renew_lease(renew)
+        assert renew.lease_duration == 50
+        assert 50 <= renew.max_ttl < 51
+        assert not self.vaultkeeper.rotation_due(renew)
+        self.vaultkeeper.configs.rotation_window = 60
+        assert self.vaultkeeper.rotation_due(renew)
+
+    @responses.activate
+    def test_rotate(self, tmpdir):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.secrets = secret.parse_secret_data([{
+            'id': 'creds1',
+            'backend': 'database',
+            'endpoint': 'https://test-postgres-instance.net',
+            'vault_path': 'database/creds/postgresql_myschema_readonly',
+            'schema': 'myschema',
+            'policy': 'read',
+            'max_ttl': 10
+        }])
+        self.vaultkeeper.configs.output_path = str(tmpdir.join('creds.json'))
+        self.vaultkeeper.configs.rotation_overlap = 0
+        control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        control.bind(tmpdir.join('c.sock').strpath)
+        control.listen(1)
+        self.vaultkeeper.configs.rotation_notify = (
+            'unix:' + tmpdir.join('c.sock').strpath)
+        self.vaultkeeper.vault_secret = unwrapped_token()
+        self.vaultkeeper.get_creds()
+        self.vaultkeeper.write_credentials()
+        self.vaultkeeper.schedule_renewals()
+        old = self.vaultkeeper.secrets['creds1']
+
+        self.vaultkeeper.renew_due()
+        assert self.vaultkeeper.secrets['creds1'] is not old
+        assert self.vaultkeeper.secrets['creds1'].fetched
+        assert self.vaultkeeper.retiring[0][1] is old
+        connection, _ = control.accept()
+        assert json.loads(connection.makefile().readline()) == {
+            'event': 'rotated', 'secret': 'creds1'}
+        connection.close()
+        control.close()
+
+        self.vaultkeeper.retire_due()
+        assert self.vaultkeeper.retiring == []
+        assert self.fake_vault.leases == {}
+
+    @pytest.mark.parametrize('mode', ['memfd', 'pipe'])
+    @responses.activate
+    def test_output_handed_to_process_by_fd(self, tmpdir, mode):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        received = tmpdir.join('received').strpath
+        self.vaultkeeper.configs.output_path = (
+            tmpdir.join('creds.txt').strpath)
+        self.vaultkeeper.configs.output_mode = mode
+        self.vaultkeeper.configs.restart_max = 1
+        self.vaultkeeper.configs.entry_cmd = (
+            "sh -c 'cat /proc/self/fd/$VAULTKEEPER_CREDENTIALS_FD > "
+            + received + "'")
+        self.vaultkeeper.get_creds()
+        self.vaultkeeper.write_credentials()
+        process = self.vaultkeeper.children[0].spawn()
+        assert process.wait() == 0
+        with open(received) as f:
+            assert json.load(f)[0]['username'] == 'testuser1'
+        assert not os.path.exists(self.vaultkeeper.configs.output_path)
+
+    @pytest.mark.parametrize('mode', ['memfd', 'pipe', 'none'])
+    def test_fd_output_needs_process_replaced(self, mode):
+        self.vaultkeeper.configs.output_mode = mode
+        with pytest.raises(KeyError) as excinfo:
+            self.vaultkeeper.build_children()
+        assert 'The process app uses the ' + mode in str(excinfo.value)
+
+        self.vaultkeeper.configs.reload_mode = 'bluegreen'
+        self.vaultkeeper.configs.readiness_probe = 'exec:true'
+        assert self.vaultkeeper.build_children()[0].output_mode == mode
+
+    def test_environment_needs_process_replaced(self):
+        self.vaultkeeper.configs.environment = {'*': {'name': '{field}'}}
+        with pytest.raises(KeyError) as excinfo:
+            self.vaultkeeper.build_children()
+        assert 'The process app is passed secrets in its environment' in (
+            str(excinfo.value))
+
+        self.vaultkeeper.configs.restart_max = 1
+        assert self.vaultkeeper.build_children()[0].environment is not None
+
+    @responses.activate
+    def test_secrets_injected_into_environment(self, tmpdir):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        received = tmpdir.join('received').strpath
+        self.vaultkeeper.configs.output_path = (
+            tmpdir.join('creds.txt').strpath)
+        self.vaultkeeper.configs.output_mode = 'none'
+        self.vaultkeeper.configs.restart_max = 1
+        self.vaultkeeper.configs.environment = {
+            'database': {'name': 'DB_{field}',
+                         'fields': ['username', 'password']}
+        }
+        self.vaultkeeper.configs.entry_cmd = (
+            "sh -c 'echo $DB_USERNAME:$DB_PASSWORD > " + received + "'")
+        self.vaultkeeper.get_creds()
+        self.vaultkeeper.write_credentials()
+        process = self.vaultkeeper.children[0].spawn()
+        assert process.wait() == 0
+        with open(received) as f:
+            assert f.read() == 'testuser1:testpass1\n'
+        assert not os.path.exists(self.vaultkeeper.configs.output_path)
+        assert 'DB_USERNAME' not in os.environ
+
+    def test_bluegreen_reload_hands_over_process(self):
+        self.vaultkeeper.configs.entry_cmd = 'sleep 5'
+        self.vaultkeeper.configs.reload_mode = 'bluegreen'
+        self.vaultkeeper.configs.readiness_probe = 'exec:true'
+        self.vaultkeeper.configs.readiness_interval = 0.01
+        self.vaultkeeper.children = self.vaultkeeper.build_children()
+        child = self.vaultkeeper.children[0]
+        old = child.spawn()
+        try:
+            self.vaultkeeper.reload_children(['creds1'])
+            assert old.poll() is not None
+            assert self.vaultkeeper.app is child.process
+            assert child.process.poll() is None
+        finally:
+            self.vaultkeeper.stop_children()
+
+    def test_bluegreen_reload_needs_probe(self):
+        self.vaultkeeper.configs.reload_mode = 'bluegreen'
+        with pytest.raises(KeyError) as excinfo:
+            self.vaultkeeper.build_children()
+        assert 'readiness_probe' in str(excinfo.value)
+
+    @responses.activate
+    def test_reload_secrets_only_fetches_changes(self, tmpdir):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        spec = {
+            'id': 'creds1',
+            'backend': 'database',
+            'endpoint': 'https://test-postgres-instance.net',
+            'vault_path': 'database/creds/postgresql_myschema_readonly',
+            'schema': 'myschema',
+            'policy': 'read'
+        }
+        config = {
+            'id': 'config',
+            'backend': 'generic',
+            'endpoint': '',
+            'vault_path': 'secret/django-consumer/config',
+            'policy': 'read'
+        }
+        secrets_path = tmpdir.join('secrets.json')
+        secrets_path.write(json.dumps([spec]))
+        self.vaultkeeper.configs.secrets_path = str(secrets_path)
+        self.vaultkeeper.configs.output_path = str(tmpdir.join('creds.json'))
+        self.vaultkeeper.setup()
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.vault_secret = unwrapped_token()
+        self.vaultkeeper.get_creds()
+        self.vaultkeeper.schedule_renewals()
+        creds1 = self.vaultkeeper.secrets['creds1']
+        assert not self.vaultkeeper.reload_due()
+
+        self.vaultkeeper.request_reload(None, None)
+        secrets_path.write(json.dumps([spec, config]))
+        assert self.vaultkeeper.reload_due()
+        calls = len(responses.calls)
+        self.vaultkeeper.reload_secrets()
+        assert len(responses.calls) == calls + 1
+        assert self.vaultkeeper.secrets['creds1'] is creds1
+        assert self.vaultkeeper.secrets['config'].fetched
+        output = json.loads(tmpdir.join('creds.json').read())
+        assert [entry['id'] for entry in output] == ['config', 'creds1']
+
+        # A changed secret's old lease is kept for the rotation overlap.
+        self.vaultkeeper.configs.rotation_overlap = 0
+        secrets_path.write(json.dumps([dict(spec, max_ttl=600), config]))
+        self.vaultkeeper.reload_secrets()
+        assert self.vaultkeeper.secrets['creds1'] is not creds1
+        assert [lease for _, lease in self.vaultkeeper.retiring] == [creds1]
+        assert not [c for c in responses.calls if
+                    c.request.url.endswith('/v1/sys/leases/revoke')]
+        self.vaultkeeper.retire_due()
+        assert self.vaultkeeper.retiring == []
+        assert responses.calls[-1].request.url.endswith(
+            '/v1/sys/leases/revoke')
+
+        secrets_path.write(json.dumps([config]))
+        self.vaultkeeper.reload_secrets()
+        assert 'creds1' not in self.vaultkeeper.secrets
+        assert self.fake_vault.leases == {}
+        assert responses.calls[-1].request.url.endswith(
+            '/v1/sys/leases/revoke')
+
+    @responses.activate
+    def test_fast_cleanup_revokes_leases_then_token(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.configs.shutdown_budget = 5
+        self.vaultkeeper.get_creds()
+        self.vaultkeeper.cleanup()
+        assert self.fake_vault.leases == {}
+        assert ('00000000-0000-0000-0000-000000000001'
+                not in self.fake_vault.tokens)
+        assert responses.calls[-1].request.url.endswith(
+            '/v1/auth/token/revoke-self')
+
+    @responses.activate
+    def test_fast_cleanup_gives_up_after_budget(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.get_creds()
+        self.fake_vault.latency = 0.5
+        start = time.time()
+        self.vaultkeeper.fast_cleanup(0.1)
+        assert time.time() - start < 0.4
+        # Let the abandoned revocations finish before the mock goes away.
+        time.sleep(1.2)
+
+    @responses.activate
+    def test_failed_reads_are_retried(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.configs.read_retries = 2
+        self.vaultkeeper.configs.read_retry_backoff = 0.01
+        read_cred = self.vaultkeeper.read_cred
+        failures = []
+
+        def flaky_read(cred):
+            if not failures:
+                failures.append(cred.name)
+                raise requests.exceptions.ConnectTimeout('connect timeout')
+            return read_cred(cred)
+
+        self.vaultkeeper.read_cred = flaky_read
+        self.vaultkeeper.get_creds()
+        assert failures == ['creds1']
+        assert self.vaultkeeper.secrets['creds1'].username == 'testuser1'
+
+    @pytest.mark.parametrize('kv_version', [1, 2])
+    @responses.activate
+    def test_missing_secret_is_named(self, kv_version):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        vault_path = 'secret/data/missing' if kv_version == 2 else (
+            'secret/missing')
+        for path in (vault_path, 'secret/metadata/missing'):
+            responses.add(responses.GET,
+                          self.fake_vault_url + '/v1/' + path, status=404)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.secrets = secret.parse_secret_data([{
+            'id': 'config',
+            'backend': 'generic',
+            'endpoint': '',
+            'vault_path': vault_path,
+            'policy': 'read',
+            'kv_version': kv_version
+        }])
+        with pytest.raises(RuntimeError) as excinfo:
+            self.vaultkeeper.get_creds()
+        assert str(excinfo.value) == (
+            'The service could not fetch the secret config from Vault: '
+            'nothing was found at ' + vault_path)
+
+    def test_sent_dynamic_reads_are_not_retried(self):
+        self.vaultkeeper.configs.read_retries = 2
+        self.vaultkeeper.configs.read_retry_backoff = 0.01
+        attempts = []
+
+        def timed_out(cred):
+            # Vault may have issued credentials for a request whose
+            # response never arrived.
+            attempts.append(cred.name)
+            raise requests.exceptions.ReadTimeout('read timeout')
+
+        self.vaultkeeper.read_cred = timed_out
+        with pytest.raises(RuntimeError):
+            self.vaultkeeper.get_creds()
+        assert attempts == ['creds1']
+
+    @responses.activate
+    def test_startup_deadline_names_slow_phase(self, tmpdir):
+        self.fake_gatekeeper.add_handlers(responses, self.fake_gatekeeper_url)
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.fake_gatekeeper.latency = 0.3
+        self.vaultkeeper.configs.startup_deadline = 0.1
+        self.vaultkeeper.configs.output_path = (
+            tmpdir.join('./creds.txt').strpath)
+        with pytest.raises(StartupTimeout) as excinfo:
+            self.vaultkeeper.start_subprocess()
+        assert excinfo.value.phase == 'gatekeeper'
+        assert excinfo.value.budget == 0.1
+        assert not [c for c in responses.calls if
+                    c.request.url.startswith(self.fake_vault_url)]
+
+    def checkpointed(self, tmpdir, monkeypatch):
+        """
+        A second agent for the same task, sharing this one's checkpoint.
+        """
+        fernet = pytest.importorskip('cryptography.fernet')
+        monkeypatch.setenv('VAULTKEEPER_CHECKPOINT_KEY',
+                           fernet.Fernet.generate_key())
+        path = tmpdir.join('checkpoint').strpath
+        self.vaultkeeper.configs.checkpoint_path = path
+        self.vaultkeeper.setup()
+        restarted = Vaultkeeper(
+            configs=agent_configs(),
+            secrets=secrets(),
+            taskid='purple-rain-486-ab24134bed3423f124937',
+            appname='purple-rain-486',
+            vault_addr='https://test-vault-instance.net',
+            gatekeeper_addr='https://test-gatekeeper-instance.net'
+        )
+        restarted.configs.checkpoint_path = path
+        restarted.setup()
+        return restarted
+
+    @responses.activate
+    def test_resume_from_checkpoint(self, tmpdir, monkeypatch):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        restarted = self.checkpointed(tmpdir, monkeypatch)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.vault_secret = unwrapped_token()
+        self.vaultkeeper.get_creds()
+        self.vaultkeeper.save_checkpoint()
+        responses.calls.reset()
+
+        assert restarted.resume()
+        cred = restarted.secrets['creds1']
+        assert cred.lease_id == (
+            'database/creds/postgresql_myschema_readonly/lease-id1')
+        assert cred.username == 'testuser1'
+        assert restarted.vault_client.token == (
+            '00000000-0000-0000-0000-000000000001')
+        paths = [c.request.url[len(self.fake_vault_url):]
+                 for c in responses.calls]
+        assert '/v1/database/creds/postgresql_myschema_readonly' not in paths
+        assert paths.count('/v1/sys/leases/renew') == 1
+        assert paths.count('/v1/auth/token/renew-self') == 1
+
+    @responses.activate
+    def test_resume_fetches_changed_secrets(self, tmpdir, monkeypatch):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        restarted = self.checkpointed(tmpdir, monkeypatch)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.vault_secret = unwrapped_token()
+        self.vaultkeeper.get_creds()
+        self.vaultkeeper.save_checkpoint()
+        restarted.secrets['creds1'].spec['schema'] = 'otherschema'
+
+        assert restarted.resume()
+        assert not restarted.secrets['creds1'].fetched
+        assert self.fake_vault.leases == {}
+
+    def test_resume_without_checkpoint(self, tmpdir, monkeypatch):
+        restarted = self.checkpointed(tmpdir, monkeypatch)
+        assert not restarted.resume()
+
+    @responses.activate
+    def test_warm_up_opens_connection_per_worker(self):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.configs.fetch_workers = 4
+        self.vaultkeeper.secrets = secret.parse_secret_data([{
+            'id': 'creds' + str(i),
+            'backend': 'database',
+            'endpoint': 'https://test-postgres-instance.net',
+            'vault_path': 'database/creds/postgresql_myschema_readonly',
+            'schema': 'myschema',
+            'policy': 'read'
+        } for i in range(2)])
+        self.vaultkeeper.warm_up()
+        assert len(responses.calls) == 2
+        assert 'warmup' in self.vaultkeeper.timings
+
+    def test_warm_up_ignores_unreachable_vault(self):
+        with responses.RequestsMock():
+            self.vaultkeeper.warm_up()
+
+    @responses.activate
+    def test_optional_secrets_fetched_after_spawn(self, tmpdir):
+        self.fake_gatekeeper.add_handlers(responses, self.fake_gatekeeper_url)
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.secrets.update(secret.parse_secret_data([{
+            'id': 'later',
+            'backend': 'database',
+            'endpoint': 'https://test-postgres-instance.net',
+            'vault_path': 'database/creds/postgresql_myschema_readonly',
+            'schema': 'myschema',
+            'policy': 'read',
+            'required': False
+        }, {
+            'id': 'missing',
+            'backend': 'database',
+            'endpoint': 'https://test-postgres-instance.net',
+            'vault_path': 'database/creds/missing',
+            'schema': 'myschema',
+            'policy': 'read',
+            'required': False
+        }]))
+        output = tmpdir.join('creds.json')
+        self.vaultkeeper.configs.output_path = output.strpath
+        self.vaultkeeper.configs.entry_cmd = 'true'
+
+        self.vaultkeeper.start_subprocess()
+        self.vaultkeeper.optional_fetch.join()
+        self.vaultkeeper.app.wait()
+
+        written = [entry['id'] for entry in json.loads(output.read())]
+        assert written == ['creds1', 'later']
+
+    @pytest.mark.parametrize('mode', ['memfd', 'none'])
+    @responses.activate
+    def test_optional_secrets_handed_over(self, mode):
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.vault_client.token = (
+            '00000000-0000-0000-0000-000000000001')
+        self.vaultkeeper.secrets.update(secret.parse_secret_data([{
+            'id': 'later',
+            'backend': 'database',
+            'endpoint': 'https://test-postgres-instance.net',
+            'vault_path': 'database/creds/postgresql_myschema_readonly',
+            'schema': 'myschema',
+            'policy': 'read',
+            'required': False
+        }]))
+        self.vaultkeeper.configs.output_mode = mode
+        self.vaultkeeper.configs.reload_mode = 'bluegreen'
+        self.vaultkeeper.configs.readiness_probe = 'exec:true'
+        self.vaultkeeper.children = self.vaultkeeper.build_children()
+        handovers = []
+        self.vaultkeeper.request_hand_over = (
+            lambda child: handovers.append(child.name))
+
+        self.vaultkeeper.get_optional_creds(
+            [self.vaultkeeper.secrets['later']])
+        assert self.vaultkeeper.secrets['later'].fetched
+        assert handovers == ['app']
+
+    @responses.activate
+    def test_run_supervises_several_processes(self, tmpdir):
+        self.fake_gatekeeper.add_handlers(responses, self.fake_gatekeeper_url)
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.secrets.update(secret.parse_secret_data([{
+            'id': 'creds2',
+            'backend': 'database',
+            'endpoint': 'https://test-postgres-instance.net',
+            'vault_path': 'database/creds/postgresql_myschema_readonly',
+            'schema': 'myschema',
+            'policy': 'read'
+        }]))
+        self.vaultkeeper.configs.processes = [{
+            'name': 'web',
+            'entry_cmd': 'python ./test/normal_success.py',
+            'secrets': ['creds1'],
+            'output_path': tmpdir.join('web.json').strpath
+        }, {
+            'name': 'worker',
+            'entry_cmd': 'sleep 30',
+            'secrets': ['creds2'],
+            'output_path': tmpdir.join('worker.json').strpath
+        }]
+
+        status_code = self.vaultkeeper.run()
+
+        assert status_code == 0
+        worker = self.vaultkeeper.children[1].process
+        assert worker.returncode == -signal.SIGTERM
+        assert [entry['id'] for entry in
+                json.loads(tmpdir.join('web.json').read())] == ['creds1']
+        assert [entry['id'] for entry in
+                json.loads(tmpdir.join('worker.json').read())] == ['creds2']
+        gatekeeper_calls = [c for c in responses.calls if
+                            c.request.url.startswith(self.fake_gatekeeper_url)]
+        assert len(gatekeeper_calls) == 1
+
+    def test_process_with_unknown_secret(self):
+        self.vaultkeeper.configs.processes = [{
+            'name': 'web',
+            'entry_cmd': 'true',
+            'secrets': ['nonexistent'],
+            'output_path': '/run/web/creds.json',
+        }]
+        with pytest.raises(KeyError) as excinfo:
+            self.vaultkeeper.build_children()
+        assert 'nonexistent' in str(excinfo.value)
+
+    @pytest.mark.parametrize('entry,problem', [
+        ({'entry_cmd': 'true', 'output_path': '/run/creds.json'}, 'name'),
+        ({'name': 'web', 'output_path': '/run/creds.json'}, 'entry_cmd'),
+        ({'name': 'web', 'entry_cmd': 'true'}, 'output_path'),
+    ])
+    @responses.activate
+    def test_incomplete_process_fails_before_startup(self, entry, problem):
+        self.fake_gatekeeper.add_handlers(responses, self.fake_gatekeeper_url)
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+        self.vaultkeeper.configs.processes = [entry]
+        with pytest.raises(KeyError) as excinfo:
+            self.vaultkeeper.start_subprocess()
+        assert problem in str(excinfo.value)
+        assert len(responses.calls) == 0
+
     @responses.activate
     def test_run_normal_success(self, tmpdir):
         self.fake_gatekeeper.add_handlers(responses, self.fake_gatekeeper_url)
@@ -175,6 +923,24 @@ class TestVaultkeeper(object):
         status_code = self.vaultkeeper.run()
         assert status_code == 3
 
+    @responses.activate
+    def test_run_restarts_without_refetching(self, tmpdir):
+        self.fake_gatekeeper.add_handlers(responses, self.fake_gatekeeper_url)
+        self.fake_vault.add_handlers(responses, self.fake_vault_url)
+
+        self.vaultkeeper.configs.output_path = (
+            tmpdir.join('./creds.txt').strpath)
+        self.vaultkeeper.configs.entry_cmd = 'python ./test/normal_failure.py'
+        self.vaultkeeper.configs.refresh_interval = 0.1
+        self.vaultkeeper.configs.restart_max = 1
+        self.vaultkeeper.configs.restart_backoff = 0.01
+        status_code = self.vaultkeeper.run()
+        assert status_code == 3
+        assert self.vaultkeeper.children[0].restarts == 1
+        reads = [c for c in responses.calls if c.request.url.endswith(
+                 '/v1/database/creds/postgresql_myschema_readonly')]
+        assert len(reads) == 1
+
     @responses.activate
     def test_run_abnormal_failure(self, tmpdir):
         """
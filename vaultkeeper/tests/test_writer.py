@@ -0,0 +1,34 @@
+import os
+import stat
+
+from vaultkeeper.writer import CredentialWriter, atomic_write
+
+
+class TestAtomicWrite(object):
+    def test_replaces_file_with_restricted_permissions(self, tmpdir):
+        path = tmpdir.join('creds.json')
+        path.write('old')
+        atomic_write(path.strpath, 'new')
+        assert path.read() == 'new'
+        assert stat.S_IMODE(os.stat(path.strpath).st_mode) == 0o600
+        assert tmpdir.listdir() == [path]
+
+
+class TestCredentialWriter(object):
+    def test_skips_unchanged_content(self, tmpdir):
+        path = tmpdir.join('creds.json').strpath
+        writer = CredentialWriter()
+        assert writer.write(path, '[1]')
+        inode = os.stat(path).st_ino
+        assert not writer.write(path, '[1]')
+        assert os.stat(path).st_ino == inode
+        assert writer.write(path, '[2]')
+        assert open(path).read() == '[2]'
+
+    def test_rewrites_removed_file(self, tmpdir):
+        path = tmpdir.join('creds.json').strpath
+        writer = CredentialWriter(0o640)
+        writer.write(path, '[1]')
+        os.unlink(path)
+        assert writer.write(path, '[1]')
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
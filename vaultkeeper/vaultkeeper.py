@@ -1,14 +1,25 @@
 import logging
 import json
 import os
+import signal
+import socket
 import sys
-import shlex
-import subprocess32 as subprocess
-from subprocess32 import TimeoutExpired
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from configparser import ConfigParser
+from concurrency import map_concurrently, BudgetExceeded
+from scheduler import RenewalScheduler
+from core import AgentCore
+from deadline import Deadline, retry
+from checkpoint import Checkpoint
+from writer import CredentialWriter
+from kvcache import KVCache
+from renderers import build_renderers, EnvironmentMapping
+from metrics import AgentMetrics, serve_metrics
+from child import Child, Handover, RestartPolicy, stop_processes
 import secret
-import hvac
-import requests
 
 
 def get_mesos_taskid(env=os.environ):
@@ -80,15 +91,78 @@ class Vaultkeeper(object):
         self.vault_addr = vault_addr
         self.gatekeeper_addr = gatekeeper_addr
         self.app = None
+        self.vault_secret = None
+        self.scheduler = None
+        self.timings = OrderedDict()
+        self.children = None
+        self.lock = threading.RLock()
+        self.optional_fetch = None
+        self.metrics = AgentMetrics(self)
+        self.metrics_server = None
+        self.secrets_mtime = None
+        self.reload_requested = False
+        self.retiring = []
+        self.core = None
+        self.deadline = Deadline()
+        self.checkpoint = None
+        self.stopping = False
 
     def setup(self):
-        self.vault_client = hvac.Client(url=self.vault_addr)
+        # hvac and requests are only loaded once the agent is set up to
+        # talk to Vault, which keeps importing this module cheap.
+        import hvac
+        from session import build_session, request_timeout
+
+        self.writer = CredentialWriter(self.configs.output_permissions)
+        self.kv_cache = KVCache()
+        if self.configs.kv_cache_path:
+            self.kv_cache = KVCache(self.configs.kv_cache_path,
+                                    self.encryption_key())
+        self.session = build_session(self.configs)
+        self.timeout = request_timeout(self.configs)
+        self.vault_client = hvac.Client(url=self.vault_addr,
+                                        session=self.session,
+                                        timeout=self.timeout)
+        if self.configs.metrics_address:
+            self.metrics_server = serve_metrics(self.metrics.registry,
+                                                self.configs.metrics_address)
+        if self.configs.secrets_path:
+            self.secrets_mtime = os.stat(self.configs.secrets_path).st_mtime
+        if self.configs.checkpoint_path:
+            self.checkpoint = Checkpoint(self.configs.checkpoint_path,
+                                         self.encryption_key())
+
+    def encryption_key(self):
+        """
+        The Fernet key for the state kept on disk: the checkpoint and the
+        KV cache.
+        """
+        key = os.environ.get(self.configs.checkpoint_key_env)
+        if not key:
+            raise RuntimeError('The checkpoint and KV cache need a key in '
+                               + 'the ' + self.configs.checkpoint_key_env
+                               + ' environment variable.')
+        return key
+
+    @contextmanager
+    def observed(self, operation):
+        start = time.time()
+        try:
+            yield
+        except Exception:
+            self.metrics.request_failures.inc(operation=operation)
+            raise
+        finally:
+            self.metrics.request_duration.observe(time.time() - start,
+                                                  operation=operation)
 
     def get_wrapped_token(self):
         payload = {'task_id': self.taskid}
-        r = requests.post(self.gatekeeper_addr + '/token',
-                          json=payload)
-        response = r.json()
+        with self.observed('gatekeeper_token'):
+            r = self.session.post(self.gatekeeper_addr + '/token',
+                                  json=payload,
+                                  timeout=self.timeout)
+            response = r.json()
         if response['ok']:
             self.wrapped_token = response['token']
             return self.wrapped_token
@@ -99,83 +173,831 @@ class Vaultkeeper(object):
 
     def unwrap_token(self, wrapped_token):
         self.vault_secret = secret.UnwrappedToken('vault_token', 'token')
-        response = self.vault_client.unwrap(wrapped_token)
+        with self.observed('unwrap'):
+            response = self.vault_client.unwrap(wrapped_token)
         self.vault_secret.add_secret(response)
         self.vault_client.token = self.vault_secret.token_value
-        if not self.vault_client.is_authenticated():
+        if not self.ensure_authenticated():
             raise RuntimeError('The service could not authenticate'
                                + 'to Vault with the unwrapped token.')
         return self.vault_client.token
 
+    def ensure_authenticated(self):
+        """
+        Check the Vault token, trusting the locally tracked token state
+        from the last unwrap or renewal for as long as it is valid.
+        """
+        token = self.vault_secret
+        if isinstance(token, secret.UnwrappedToken) and token.is_valid():
+            return True
+        return self.vault_client.is_authenticated()
+
+    def vault_request(self, method, *args, **kwargs):
+        from hvac.exceptions import Forbidden
+
+        if not self.ensure_authenticated():
+            raise RuntimeError('The service could not authenticate '
+                               + 'to Vault.')
+        try:
+            with self.observed(method.__name__):
+                return method(*args, **kwargs)
+        except Forbidden:
+            token = self.vault_secret
+            if isinstance(token, secret.UnwrappedToken):
+                token.invalidate()
+            if not self.vault_client.is_authenticated():
+                raise RuntimeError('The service\'s Vault token is no '
+                                   + 'longer valid.')
+            # The token is fine, and the request was denied by policy.
+            if isinstance(token, secret.UnwrappedToken):
+                token.verify()
+            raise
+
+    def build_children(self):
+        """
+        The processes to supervise: either the configured processes, or a
+        single process running entry_cmd with every secret.
+        """
+        if self.configs.processes is None:
+            child = Child('app', self.configs.entry_cmd, None,
+                          build_renderers(self.configs.renderers,
+                                          self.configs.output_path),
+                          self.configs.rotation_notify,
+                          self.restart_policy({}),
+                          self.handover({'name': 'app'}),
+                          self.output_mode({}),
+                          self.configs.output_fd_env,
+                          self.environment({}))
+            self.check_output_mode(child)
+            return [child]
+        children = []
+        for entry in self.configs.processes:
+            self.check_process(entry)
+            secret_ids = entry.get('secrets')
+            for name in secret_ids or []:
+                if name not in self.secrets:
+                    raise KeyError('The process ' + entry['name']
+                                   + ' uses an unknown secret: ' + name)
+            children.append(Child(entry['name'], entry['entry_cmd'],
+                                  secret_ids,
+                                  build_renderers(entry.get('renderers'),
+                                                  entry.get('output_path')),
+                                  entry.get('rotation_notify',
+                                            self.configs.rotation_notify),
+                                  self.restart_policy(entry),
+                                  self.handover(entry),
+                                  self.output_mode(entry),
+                                  self.process_setting(entry,
+                                                       'output_fd_env'),
+                                  self.environment(entry)))
+            self.check_output_mode(children[-1])
+        return children
+
+    def check_process(self, entry):
+        """
+        Reject an entry in the processes configuration that is missing
+        settings, before any credentials are issued for it.
+        """
+        if not entry.get('name'):
+            raise KeyError('A process has no name.')
+        if not entry.get('entry_cmd'):
+            raise KeyError('The process ' + entry['name']
+                           + ' has no entry_cmd.')
+        if (self.process_setting(entry, 'output_mode') == 'file'
+                and not entry.get('output_path')
+                and not entry.get('renderers')):
+            raise KeyError('The process ' + entry['name']
+                           + ' has neither an output_path nor renderers.')
+
+    def check_output_mode(self, child):
+        """
+        Reject an output mode or environment that hands credentials over
+        only when the process starts, unless the process is replaced or
+        restarted to pick up credentials that were rotated, reloaded or
+        fetched late.
+        """
+        if child.handover is not None or child.restart is not None:
+            return
+        if child.output_mode != 'file':
+            raise KeyError('The process ' + child.name + ' uses the '
+                           + child.output_mode + ' output_mode, which '
+                           + 'needs the bluegreen reload_mode or '
+                           + 'restart_max to receive new credentials.')
+        if child.environment is not None:
+            raise KeyError('The process ' + child.name + ' is passed '
+                           + 'secrets in its environment, which needs the '
+                           + 'bluegreen reload_mode or restart_max to '
+                           + 'receive new credentials.')
+
+    def process_setting(self, entry, key):
+        return entry.get(key, getattr(self.configs, key))
+
+    def restart_policy(self, entry):
+        """
+        The restart policy for a process, whose entry in the processes
+        configuration can override the agent-wide restart settings.
+        """
+        if not self.process_setting(entry, 'restart_max'):
+            return None
+        return RestartPolicy(
+            self.process_setting(entry, 'restart_max'),
+            self.process_setting(entry, 'restart_backoff'),
+            self.process_setting(entry, 'restart_max_backoff'),
+            self.process_setting(entry, 'restart_exit_codes'))
+
+    def output_mode(self, entry):
+        mode = self.process_setting(entry, 'output_mode')
+        if mode not in ('file', 'memfd', 'pipe', 'none'):
+            raise KeyError('Unknown output_mode: ' + mode)
+        return mode
+
+    def environment(self, entry):
+        mappings = self.process_setting(entry, 'environment')
+        if mappings is None:
+            return None
+        return EnvironmentMapping(mappings)
+
+    def handover(self, entry):
+        """
+        How to replace a process when its secrets change in the bluegreen
+        reload mode, or None to notify it according to rotation_notify.
+        """
+        mode = self.process_setting(entry, 'reload_mode')
+        if mode == 'notify':
+            return None
+        if mode != 'bluegreen':
+            raise KeyError('Unknown reload_mode: ' + mode)
+        probe = self.process_setting(entry, 'readiness_probe')
+        if not probe:
+            raise KeyError('The process ' + entry['name'] + ' is reloaded '
+                           + 'blue/green, which needs a readiness_probe.')
+        return Handover(probe,
+                        self.process_setting(entry, 'readiness_timeout'),
+                        self.process_setting(entry, 'readiness_interval'))
+
     def write_credentials(self):
-        data = secret.printable_secrets(self.secrets)
-        with open(self.configs.output_path, 'w') as outfile:
-            json.dump(data, outfile)
+        if self.children is None:
+            self.children = self.build_children()
+        written = False
+        with self.lock:
+            for child in self.children:
+                child.env = child.render_environment(self.secrets)
+                if child.output_mode == 'none':
+                    continue
+                outputs = child.render(self.secrets)
+                if child.output_mode != 'file':
+                    # Handed to the process when it is next started.
+                    child.outputs = outputs
+                    continue
+                for path, content in outputs:
+                    written = self.writer.write(path, content) or written
+        return written
 
     def get_cred(self, vault_path):
-        if not self.vault_client.is_authenticated():
-            raise RuntimeError('The service could not authenticate '
-                               + 'to Vault to retrieve credentials.')
-        return self.vault_client.read(vault_path)
+        return self.vault_request(self.vault_client.read, vault_path)
+
+    def get_cached_cred(self, vault_path):
+        """
+        Read a static secret through the node-local secret cache, falling
+        back to Vault if the cache cannot be reached.
+        """
+        from cache import read_cached
+
+        try:
+            with self.observed('cache_read'):
+                return read_cached(self.configs.cache_socket,
+                                   self.vault_client.token, vault_path,
+                                   self.configs.http_read_timeout)
+        except socket.error as e:
+            self.logger.warning('Could not reach the secret cache: '
+                                + str(e))
+            return self.get_cred(vault_path)
+
+    def read_cred(self, cred):
+        if self.configs.cache_socket and cred.cacheable:
+            return self.get_cached_cred(cred.vault_path)
+        return self.get_cred(cred.vault_path)
+
+    def get_versioned_cred(self, cred):
+        """
+        Read a KV version 2 secret, reusing the last read of it unless its
+        metadata shows that it has a new version.
+        """
+        from hvac.exceptions import Forbidden
+
+        try:
+            metadata = self.get_cred(cred.metadata_path())
+        except Forbidden:
+            self.logger.warning('Cannot read the metadata of ' + cred.name
+                                + ', so reading it in full.')
+            return self.read_cred(cred)
+        if metadata is None:
+            return None
+        response = self.kv_cache.get(cred.vault_path,
+                                     metadata['data']['current_version'])
+        if response is None:
+            response = self.read_cred(cred)
+            self.kv_cache.put(cred.vault_path, response)
+        return response
+
+    def retryable_errors(self, cred):
+        """
+        The errors after which a read of cred may be retried.
+
+        Static secrets can be read again after any failed connection,
+        timeout or server error. Reading a dynamic secret issues new
+        credentials, so it is only retried when Vault cannot have handled
+        the request: the connection could not be opened, or Vault was
+        sealed or rate limiting.
+        """
+        import requests
+        from hvac import exceptions
+
+        if cred.cacheable:
+            return (requests.RequestException,
+                    exceptions.InternalServerError,
+                    exceptions.VaultDown, exceptions.RateLimitExceeded)
+        return (requests.exceptions.ConnectTimeout, exceptions.VaultDown,
+                exceptions.RateLimitExceeded)
 
-    def get_creds(self):
-        for cred in self.secrets.itervalues():
-            response = self.get_cred(cred.vault_path)
-            cred.add_secret(response)
+    def fetch_cred(self, cred):
+        def read():
+            if getattr(cred, 'kv_version', 1) == 2:
+                return self.get_versioned_cred(cred)
+            return self.read_cred(cred)
+
+        try:
+            response = retry(read, self.configs.read_retries,
+                             self.configs.read_retry_backoff,
+                             self.retryable_errors(cred), self.deadline)
+        except Exception as e:
+            raise RuntimeError('The service could not fetch the secret '
+                               + cred.name + ' from Vault: ' + str(e))
+        if response is None:
+            raise RuntimeError('The service could not fetch the secret '
+                               + cred.name + ' from Vault: nothing was '
+                               + 'found at ' + cred.vault_path)
+        cred.add_secret(response)
+        return cred
+
+    def get_creds(self, creds=None, wait=False):
+        if creds is None:
+            creds = self.secrets.values()
+        map_concurrently(self.fetch_cred, creds, self.configs.fetch_workers,
+                         wait=wait)
+
+    def get_optional_creds(self, creds):
+        """
+        Fetch secrets that the application can start without, adding each
+        one to the output as soon as it is available, and getting the
+        processes that consume it to pick it up. Failures are logged rather
+        than raised.
+        """
+        def fetch(cred):
+            try:
+                self.fetch_cred(cred)
+            except RuntimeError as e:
+                self.logger.error(str(e))
+                return
+            with self.lock:
+                self.write_credentials()
+                if self.scheduler is not None:
+                    self.scheduler.schedule(cred)
+            self.reload_children([cred.name])
+            self.save_checkpoint()
+
+        with self.timed('optional_creds'):
+            map_concurrently(fetch, creds, self.configs.fetch_workers)
+
+    def lease_increment(self, lease):
+        return (lease.lease_increment
+                or self.configs.lease_increment
+                or lease.lease_duration)
 
     def renew_token(self, ttl):
-        result = self.vault_client.renew_token(increment=ttl)
-        self.vault_secret.update_ttl(ttl)
+        result = self.vault_request(self.vault_client.renew_token,
+                                    increment=ttl)
+        self.vault_secret.update_ttl(result['auth']['lease_duration'])
         return result
 
     def renew_lease(self, s):
-        assert self.vault_client.is_authenticated()
-        result = self.vault_client.renew_secret(s.lease_id,
-                                                s.lease_duration)
-        s.update_lease(s.lease_id, s.lease_duration)
+        increment = self.lease_increment(s)
+        result = self.vault_request(self.vault_client.renew_secret,
+                                    s.lease_id, increment)
+        s.update_lease(result['lease_id'], result['lease_duration'])
+        # Vault cuts renewals short once they would outlive the lease's
+        # max TTL, which tells us when the lease will die for good.
+        if (s.max_ttl is None and s.issued_at is not None
+                and result['lease_duration'] < increment):
+            s.max_ttl = s.expires_at - s.issued_at
         return result
 
+    def rotation_due(self, lease):
+        max_expiry = lease.max_expiry()
+        if lease.spec is None or max_expiry is None:
+            return False
+        window = self.configs.rotation_window
+        if window is None:
+            window = self.configs.renewal_grace
+        return max_expiry - time.time() <= window
+
+    def rotate(self, lease):
+        """
+        Replace a lease that is about to reach its max TTL with a freshly
+        issued one, rewrite the output and notify the processes using it.
+        The old lease is revoked once the rotation overlap has passed.
+        """
+        self.logger.info('Rotating credentials for ' + lease.name)
+        replacement = secret.parse_secret_data([lease.spec])[lease.name]
+        try:
+            self.fetch_cred(replacement)
+        except RuntimeError as e:
+            self.logger.error(str(e))
+            retry = min(self.configs.refresh_interval,
+                        max((lease.expires_at - time.time()) / 2, 1))
+            self.scheduler.schedule(lease, time.time() + retry)
+            return
+        with self.lock:
+            if self.secrets.get(lease.name) is not lease:
+                # The secret was reloaded while this one was being fetched.
+                self.revoke_lease(replacement)
+                return
+            self.secrets[lease.name] = replacement
+            self.scheduler.schedule(replacement)
+            self.write_credentials()
+            self.retiring.append(
+                (time.time() + self.configs.rotation_overlap, lease))
+        self.save_checkpoint()
+        self.reload_children([lease.name])
+
+    def reload_children(self, names):
+        """
+        Get the processes that consume any of the named secrets to pick up
+        their new credentials, either by handing over to a new process or
+        by notifying the running one.
+        """
+        for child in self.children or []:
+            used = [name for name in names if child.uses(name)]
+            if not used:
+                continue
+            if child.handover is not None:
+                self.request_hand_over(child)
+                continue
+            for name in used:
+                try:
+                    child.rotated(name)
+                except (socket.error, OSError) as e:
+                    self.logger.warning('Could not notify ' + child.name
+                                        + ' of the rotation of ' + name
+                                        + ': ' + str(e))
+
+    def request_hand_over(self, child):
+        """
+        Replace a process with a new one. Under the agent core, this runs
+        as its own task, so that waiting for the new process to become
+        ready never holds up renewals.
+        """
+        child.handover_due = True
+        if self.core is None:
+            self.hand_over(child)
+        else:
+            self.core.wake()
+
+    def hand_over(self, child):
+        # Changes made from here on are picked up by the new process, and
+        # later ones by another handover.
+        child.handover_due = False
+        self.logger.info('Starting a new ' + child.name + ' process to '
+                         + 'take over with the new credentials.')
+        try:
+            took_over = child.hand_over(self.configs.stop_timeout)
+        except OSError as e:
+            self.logger.error('Could not start a new ' + child.name
+                              + ' process: ' + str(e))
+            return
+        if not took_over:
+            self.logger.error('The new ' + child.name + ' process did not '
+                              + 'become ready, keeping the old one.')
+            return
+        if self.core is not None:
+            self.core.loop.watch(child)
+        if child is self.children[0]:
+            self.app = child.process
+
+    def retirement_due(self, now):
+        with self.lock:
+            return any(retire_at <= now for retire_at, _ in self.retiring)
+
+    def retire_due(self):
+        """
+        Revoke rotated leases whose overlap has passed.
+        """
+        now = time.time()
+        with self.lock:
+            due = [lease for retire_at, lease in self.retiring
+                   if retire_at <= now]
+            self.retiring = [(retire_at, lease)
+                             for retire_at, lease in self.retiring
+                             if retire_at > now]
+        for lease in due:
+            self.revoke_lease(lease)
+        if due:
+            self.save_checkpoint()
+
     def renew_all(self):
-        for entry in self.secrets.itervalues():
-            if entry.renewable:
-                self.renew_lease(entry)
+        leases = [entry for entry in self.secrets.itervalues()
+                  if entry.renewable]
+        map_concurrently(self.renew_lease, leases,
+                         self.configs.renewal_workers)
+
+    def schedule_renewals(self):
+        scheduler = RenewalScheduler(self.configs.renewal_grace,
+                                     self.configs.renewal_jitter,
+                                     self.configs.renewal_splay,
+                                     self.taskid,
+                                     self.configs.rotation_window)
+        with self.lock:
+            scheduler.schedule(self.vault_secret)
+            for entry in self.secrets.itervalues():
+                if entry.fetched:
+                    scheduler.schedule(entry)
+            self.scheduler = scheduler
+
+    def renew_due(self):
+        now = time.time()
+        due = self.scheduler.pop_due(now)
+        for lease in due:
+            self.logger.info('Renewing lease for ' + lease.name)
+            self.metrics.renewal_lag.observe(
+                max(now - self.scheduler.renewal_time(lease), 0))
+        # Renew the token first, so that lease renewals never race a token
+        # that is about to expire.
+        if self.vault_secret in due:
+            due.remove(self.vault_secret)
+            self.renew_token(self.lease_increment(self.vault_secret))
+            self.scheduler.schedule(self.vault_secret)
+
+        def renew(lease):
+            if self.rotation_due(lease):
+                self.rotate(lease)
+                return
+            self.renew_lease(lease)
+            self.scheduler.schedule(lease)
+
+        map_concurrently(renew, due, self.configs.renewal_workers)
+        self.save_checkpoint()
+
+    def next_wakeup(self):
+        """
+        Time (in seconds) to wait for the application before the next
+        lease is due for renewal, capped at the refresh interval.
+        """
+        wakeup = self.configs.refresh_interval
+        if self.configs.secrets_path:
+            wakeup = min(wakeup, self.configs.secrets_poll_interval)
+        due = self.scheduler.next_due()
+        with self.lock:
+            for retire_at, _ in self.retiring:
+                if due is None or retire_at < due:
+                    due = retire_at
+        if due is not None:
+            wakeup = min(wakeup, max(due - time.time(), 0))
+        return wakeup
+
+    def request_reload(self, signum, frame):
+        self.reload_requested = True
+        if self.core is not None:
+            self.core.wake()
+
+    def reload_due(self):
+        if not self.configs.secrets_path:
+            return False
+        try:
+            mtime = os.stat(self.configs.secrets_path).st_mtime
+        except OSError as e:
+            self.logger.error('Could not read the secret configuration: '
+                              + str(e))
+            return False
+        return self.reload_requested or mtime != self.secrets_mtime
+
+    def reload_secrets(self):
+        """
+        Re-read the secret configuration, fetching only secrets that were
+        added or changed. The leases of secrets that were removed are
+        revoked, and those of secrets that were changed are retired once
+        the rotation overlap has passed, as for a rotation. Unchanged
+        secrets keep their leases.
+        """
+        self.reload_requested = False
+        path = self.configs.secrets_path
+        self.secrets_mtime = os.stat(path).st_mtime
+        try:
+            with open(path) as f:
+                specs = secret.parse_secret_data(json.load(f))
+        except (IOError, ValueError, KeyError) as e:
+            self.logger.error('Could not reload the secret configuration: '
+                              + str(e))
+            return
+        with self.lock:
+            current = dict(self.secrets)
+        secrets = {}
+        added = []
+        for name, cred in specs.iteritems():
+            if name in current and current[name].spec == cred.spec:
+                secrets[name] = current[name]
+            else:
+                secrets[name] = cred
+                added.append(cred)
+        removed = [cred for name, cred in current.iteritems()
+                   if secrets.get(name) is not cred]
+        leases = [cred for cred in removed if cred.fetched and cred.lease_id]
+        try:
+            # Fetches still in flight are waited for, so that the leases
+            # they are issued can be revoked.
+            self.get_creds([cred for cred in added if cred.required],
+                           wait=True)
+        except RuntimeError as e:
+            self.logger.error('Keeping the previous secret configuration: '
+                              + str(e))
+            for cred in added:
+                if cred.fetched and cred.lease_id:
+                    self.revoke_lease(cred)
+            return
+        with self.lock:
+            self.secrets = secrets
+            for cred in removed:
+                self.scheduler.discard(cred)
+            for cred in added:
+                if cred.fetched:
+                    self.scheduler.schedule(cred)
+            self.write_credentials()
+            # Processes keep using replaced leases until they have picked
+            # up the new ones.
+            retire_at = time.time() + self.configs.rotation_overlap
+            self.retiring.extend((retire_at, cred) for cred in leases
+                                 if cred.name in secrets)
+        self.save_checkpoint()
+        self.logger.info('Reloaded the secret configuration: %d added or '
+                         'changed, %d removed or replaced.'
+                         % (len(added), len(removed)))
+        self.reload_children([cred.name for cred in added if cred.fetched])
+        for cred in leases:
+            if cred.name not in secrets:
+                self.revoke_lease(cred)
+        optional = [cred for cred in added if not cred.required]
+        if optional:
+            self.get_optional_creds(optional)
+
+    def save_checkpoint(self):
+        if self.checkpoint is None or self.vault_secret is None:
+            return
+        try:
+            with self.lock:
+                self.checkpoint.save(self.vault_secret, self.secrets,
+                                     [lease for _, lease in self.retiring])
+        except (IOError, OSError) as e:
+            self.logger.warning('Could not save the checkpoint: ' + str(e))
+
+    def resumed_lease(self, state):
+        spec = state['spec']
+        cred = secret.parse_secret_data([spec])[spec['id']]
+        cred.resume(state)
+        return cred
+
+    def resume(self):
+        """
+        Take over the token and leases checkpointed by a previous agent
+        for this task, renewing each once to check that it is still live.
+        Leases for secrets that have since been changed or removed are
+        revoked, and secrets whose leases cannot be resumed are left to be
+        fetched as usual.
+
+        :returns: Whether the token was resumed.
+        """
+        state = self.checkpoint.load()
+        if state is None:
+            return False
+        token = secret.UnwrappedToken('vault_token', 'token')
+        token.resume(state['token'])
+        self.vault_secret = token
+        self.vault_client.token = token.token_value
+        try:
+            self.renew_token(self.lease_increment(token))
+        except Exception as e:
+            self.logger.warning('Could not resume the checkpointed Vault '
+                                + 'token: ' + str(e))
+            self.vault_secret = None
+            self.vault_client.token = None
+            return False
+        stale = [self.resumed_lease(lease) for lease in state['retiring']]
+        leases = []
+        for name, lease in state['secrets'].iteritems():
+            cred = self.resumed_lease(lease)
+            current = self.secrets.get(name)
+            if current is not None and current.spec == cred.spec:
+                leases.append(cred)
+            else:
+                stale.append(cred)
+
+        def renew(cred):
+            try:
+                self.renew_lease(cred)
+            except Exception as e:
+                self.logger.warning('Could not resume the lease for '
+                                    + cred.name + ': ' + str(e))
+                return False
+            return True
+
+        renewed = map_concurrently(renew, leases,
+                                   self.configs.renewal_workers)
+        for cred, ok in zip(leases, renewed):
+            if ok:
+                self.secrets[cred.name] = cred
+        for lease in stale:
+            self.revoke_lease(lease)
+        self.logger.info('Resumed %d of %d leases from the checkpoint.'
+                         % (sum(renewed), len(leases)))
+        return True
+
+    def revoke_lease(self, s):
+        try:
+            with self.observed('revoke_secret'):
+                self.vault_client.revoke_secret(s.lease_id)
+        except Exception as e:
+            self.logger.warning('Could not revoke the lease for '
+                                + s.name + ': ' + str(e))
+
+    def revoke_token(self):
+        try:
+            with self.observed('revoke_self_token'):
+                self.vault_client.revoke_self_token()
+        except Exception as e:
+            self.logger.warning('Could not revoke the Vault token: '
+                                + str(e))
+
+    def fast_cleanup(self, budget):
+        """
+        Revoke every lease concurrently and then the token, giving up on
+        whatever is still in flight once budget seconds have passed.
+
+        Leases are revoked before the token, because revoking the token
+        invalidates it for the lease revocations, and leaves Vault to
+        cascade the revocation of any leases that are left.
+        """
+        deadline = time.time() + budget
+        leases = [s for s in self.secrets.itervalues()
+                  if s.fetched and s.lease_id]
+        with self.lock:
+            leases.extend(lease for _, lease in self.retiring)
+        try:
+            map_concurrently(self.revoke_lease, leases, len(leases),
+                             timeout=budget)
+        except BudgetExceeded:
+            self.logger.warning('Ran out of time revoking leases.')
+        revoke = threading.Thread(target=self.revoke_token)
+        revoke.daemon = True
+        revoke.start()
+        revoke.join(max(deadline - time.time(), 0))
+        if revoke.is_alive():
+            self.logger.warning('Ran out of time revoking the Vault token.')
 
     def cleanup(self):
-        self.vault_client.revoke_self_token()
+        # Every lease is about to be revoked, so none are left to resume.
+        if self.checkpoint is not None:
+            self.checkpoint.clear()
+        if self.configs.shutdown_budget is not None:
+            self.fast_cleanup(self.configs.shutdown_budget)
+            return
+        with self.observed('revoke_self_token'):
+            self.vault_client.revoke_self_token()
+
+    @contextmanager
+    def timed(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings[phase] = time.time() - start
+
+    def warm_up(self):
+        """
+        Open as many pooled connections to Vault as the credential reads
+        will use, so that they do not pay for TCP and TLS setup.
+        """
+        import requests
+
+        def ping(_):
+            try:
+                self.session.head(self.vault_addr + '/v1/sys/health',
+                                  timeout=self.timeout)
+            except requests.RequestException as e:
+                self.logger.warning('Could not warm up a connection to '
+                                    + 'Vault: ' + str(e))
+
+        connections = max(min(self.configs.fetch_workers,
+                              len(self.secrets)), 1)
+        with self.timed('warmup'):
+            map_concurrently(ping, range(connections), connections)
+
+    @contextmanager
+    def startup_phase(self, phase):
+        with self.timed(phase), self.deadline.phase(phase):
+            yield
 
     def start_subprocess(self):
-        self.get_wrapped_token()
-        self.unwrap_token(self.wrapped_token)
-        self.logger.info('Written credentials to '
-                         + self.configs.output_path)
-        self.get_creds()
+        started = time.time()
+        self.deadline = Deadline(self.configs.startup_deadline,
+                                 self.configs.startup_phase_budgets)
+        if self.children is None:
+            self.children = self.build_children()
+        self.session.deadline = self.deadline
+        if self.configs.pipelined_startup:
+            warm_up = threading.Thread(target=self.warm_up)
+            warm_up.daemon = True
+            warm_up.start()
+        resumed = False
+        if self.checkpoint is not None:
+            with self.startup_phase('resume'):
+                resumed = self.resume()
+        if not resumed:
+            with self.startup_phase('gatekeeper'):
+                self.get_wrapped_token()
+            with self.startup_phase('unwrap'):
+                self.unwrap_token(self.wrapped_token)
+        required = [cred for cred in self.secrets.itervalues()
+                    if cred.required and not cred.fetched]
+        optional = [cred for cred in self.secrets.itervalues()
+                    if not cred.required and not cred.fetched]
+        with self.startup_phase('creds'):
+            self.get_creds(required)
+        with self.startup_phase('write'):
+            self.write_credentials()
+        self.save_checkpoint()
+        self.logger.info('Written credentials.')
+        with self.startup_phase('spawn'):
+            for child in self.children:
+                child.spawn()
+        self.deadline.finish()
+        self.app = self.children[0].process
+        self.metrics.child_start.set(time.time() - started)
+        if optional:
+            self.optional_fetch = threading.Thread(
+                target=self.get_optional_creds, args=(optional,))
+            self.optional_fetch.daemon = True
+            self.optional_fetch.start()
+
+    def restart_delay(self, child):
+        """
+        Time (in seconds) to wait before restarting a process that exited,
+        or None if the agent should shut down instead.
+        """
+        if self.stopping:
+            return None
+        return child.restart_delay()
+
+    def restart_child(self, child):
+        """
+        Start a process that exited again, with the credentials that are
+        already held.
+        """
+        self.logger.info('Restarting process ' + child.name + '.')
+        # Put back any output that the process removed.
         self.write_credentials()
-        args = shlex.split(self.configs.entry_cmd.encode(
-            'utf-8', errors='ignore'))
-        self.app = subprocess.Popen(args,
-                                    shell=False
-                                    )
+        child.respawn()
+        self.metrics.child_restarts.inc(process=child.name)
+        if child is self.children[0]:
+            self.app = child.process
+
+    def stop_children(self):
+        stop_processes([child.process for child in self.children],
+                       self.configs.stop_timeout)
 
     def watch_and_renew(self):
-        while True:
-            try:
-                self.app.wait(timeout=self.configs.refresh_interval)
-            except TimeoutExpired:
-                self.logger.info('Renewing leases...')
-                self.renew_token(self.vault_secret.lease_duration)
-                self.renew_all()
-            else:
-                self.cleanup()
-                return self.app.returncode
+        self.core = AgentCore(self)
+        return self.core.run()
+
+    def forward_signal(self, signum, frame):
+        """
+        Pass termination signals on to the supervised processes, so that
+        the agent cleans up after they exit instead of dying with them.
+        """
+        self.stopping = True
+        for child in self.children or []:
+            if child.process is not None and child.process.poll() is None:
+                child.process.send_signal(signum)
+        if self.core is not None:
+            self.core.wake()
 
     def run(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.forward_signal)
+        signal.signal(signal.SIGHUP, self.request_reload)
         self.start_subprocess()
         return self.watch_and_renew()
 
 
 def main():
     config = get_vaultkeeper_cfg()
-    secrets = get_secrets_cfg()
     taskid = get_mesos_taskid()
     appname = get_marathon_appname()
     vault_addr = get_vault_addr()
@@ -184,6 +1006,11 @@ def main():
     configs = ConfigParser(config=config)
     configs.load_configs()
 
+    if configs.secrets_path:
+        with open(configs.secrets_path) as f:
+            secrets = f.read()
+    else:
+        secrets = get_secrets_cfg()
     required_secrets = secret.parse_secret_data(json.loads(secrets))
 
     vaultkeeper = Vaultkeeper(configs=configs,
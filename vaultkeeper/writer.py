@@ -0,0 +1,51 @@
+import hashlib
+import os
+import tempfile
+
+
+def atomic_write(path, content, mode=0o600):
+    """
+    Replace the file at path with content, so that readers only ever see
+    either the old or the new file in full.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix='.' + os.path.basename(path) + '.')
+    try:
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, 'wb') as outfile:
+            outfile.write(content)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+class CredentialWriter(object):
+    def __init__(self, mode=0o600):
+        """
+        Write credential files atomically, skipping rewrites of unchanged
+        content.
+
+        :param mode: The permission bits for written files.
+        """
+        self.mode = mode
+        self.digests = {}
+
+    def write(self, path, content):
+        digest = hashlib.sha256(content).hexdigest()
+        if self.digests.get(path) == digest and os.path.exists(path):
+            return False
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        atomic_write(path, content, self.mode)
+        self.digests[path] = digest
+        return True